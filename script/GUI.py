@@ -2,24 +2,57 @@
 from tkinter import *
 from tkinter import ttk
 
-import os
+import queue
+import threading
 import time
 
 import pandas as pd
 
 import fetch as fetch
+import metrics
+from clades import CladeIndex, parse_selection
+from search import SearchIndex
+from store import OrganismStore, organism_dir
+from status import build_status, has_downloads
+from stats import StatsCache, format_rollup
+
+# milliseconds between two polls of the worker events, and events handled per poll
+POLL_DELAY = 50
+MAX_EVENTS = 200
+
+# child of a node whose children are not inserted yet
+PLACEHOLDER = '#placeholder'
+ROOT_PATH = "../Results/"
+# matches listed under the search box
+NB_MATCHES = 20
 
 class GUI:
     def __init__(self):
         # attribute
-        self.organism_df = fetch.load_df_from_pickle()
-        self.is_in_critical_section = False
+        self.store = fetch.load_store()
+        # downloaded / total organisms under every directory, built in the background
+        self.status = None
+        # taxonomy / clade index, opened by the worker on the first search by taxid
+        self.clades = None
+        # name / accession index of the search box, built in the background
+        self.search_index = None
+        self.match_directories = []
+        # nodes whose region statistics are asked to the stats thread
+        self.stats_requests = queue.Queue()
+        self.scheduler = fetch.Scheduler()
+        # background work: events sent by the worker thread, polled with after()
+        self.worker = None
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.progress = None
         # Creating window
         self.window = Tk()
         self.window.geometry("1200x800")
         self.window.title("GenBank Application")
 
+        # inserted tree nodes
         self.tree_array = []
+        self.selected_node = None
         # Frame 1 : Liste des fichiers
         (self.treeview, self.scrollbar) = self.create_tree()
         self.treeview.bind("<<TreeviewSelect>>", self.on_tree_select)
@@ -33,42 +66,78 @@ class GUI:
         # Regions menu
         (self.selected_region, self.menu_menu, self.run_search, self.OptionList_region) = self.create_region_menu()
 
+        # Taxonomy / clade selection
+        (self.taxid_text, self.taxid_entry) = self.create_taxid_entry()
+
         # Reset button
         self.reset_button = self.create_reset_button()
 
-        self.update_tree_tags()
+        # Refresh button
+        self.refresh_button = self.create_refresh_button()
+
+        # Offline mode
+        (self.offline, self.offline_button) = self.create_offline_button()
+
+        # Packed output
+        (self.packed, self.packed_button) = self.create_packed_button()
+
+        # Refresh of the records that changed only
+        (self.changed_only, self.changed_only_button) = self.create_changed_only_button()
+
+        # Cancel button
+        self.cancel_button = self.create_cancel_button()
+
+        threading.Thread(target = self.status_worker, daemon = True).start()
+        threading.Thread(target = self.stats_worker, daemon = True).start()
+        threading.Thread(target = self.search_index_worker, args = (self.store,), daemon = True).start()
+        self.window.after(POLL_DELAY, self.poll_events)
 
         # Start mainloop
         self.window.mainloop()
 
     # TREE CREATION METHODS
-    def tree_exist(self, tree, name) :
-        if tree.exists(name) :
-            name += '1'
-            self.tree_exist(tree, name)
-        return name
-
-    def create_node(self, tree, node_path, node) :
-        name_nodes = os.listdir(node_path)
-        if name_nodes == [] : pass
-        for name in name_nodes :
-            name_path = node_path + name
-            if os.path.isdir(name_path):
-                name = self.tree_exist(tree, name)
-                try :
-                    tree.insert(node, '1000000',iid=name, text=name, tags=('not_dl'))
-                    self.tree_array.append(name)
-                    name_path += '/'
-                    self.create_node(tree, name_path, name)
-                except:
-                    print(name_path)
-                    pass
+    # nodes are identified by their Results directory ('../Results/Archaea/'),
+    # the children of a node are only inserted when it is opened
+
+    def insert_node(self, tree, parent, directory, text, has_children):
+        tree.insert(parent, END, iid=directory, text=text, tags=('not_dl'))
+        self.tree_array.append(directory)
+        self.tag_node(directory)
+        if has_children:
+            # placeholder making the node expandable
+            tree.insert(directory, END, iid=directory + PLACEHOLDER)
+
+    def populate_node(self, tree, directory):
+        """
+        insert the children of directory read from the organism index
+        """
+        if not tree.exists(directory + PLACEHOLDER):
+            return
+        tree.delete(directory + PLACEHOLDER)
+        (subdirs, organisms) = self.store.children(directory)
+        for subdir in subdirs:
+            self.insert_node(tree, directory, subdir, subdir[len(directory):-1], True)
+        for (name, organism_directory) in organisms:
+            self.insert_node(tree, directory, organism_directory, organism_directory[len(directory):-1], False)
 
+    def on_tree_open(self, event):
+        self.populate_node(self.treeview, self.treeview.focus())
 
     def create_tree(self):
         list = Frame(self.window)
         list.place(x=0, y=0, anchor="nw", width=400, height=800)
 
+        # Search box, matches are listed under it as the name is typed
+        self.search_text = StringVar(list)
+        search_entry = Entry(list, textvariable = self.search_text)
+        search_entry.pack(side = TOP, fill = X)
+        search_entry.bind("<Return>", self.on_search_return)
+        search_entry.bind("<Down>", lambda event: self.search_matches.focus_set())
+        self.search_matches = Listbox(list, height = 8)
+        self.search_matches.pack(side = TOP, fill = X)
+        self.search_matches.bind("<<ListboxSelect>>", self.on_match_select)
+        self.search_text.trace("w", self.on_search_changed)
+
         # Creating treeview window
         scrollbar = Scrollbar(list)
         scrollbar.pack( side = RIGHT, fill = Y )
@@ -80,16 +149,33 @@ class GUI:
         treeview.pack(fill="both", expand=True)
         scrollbar.configure(command=treeview.yview)
 
-        root_path = "../Results/"
-        treeview.insert('', '0', text='Results', iid='Results', tags=('not_dl'))
-        self.tree_array.append('Results')
-        self.create_node(treeview, root_path, 'Results')
-
         treeview.tag_configure('not_dl', background='yellow')
         treeview.tag_configure('dl', background='lightgreen')
 
+        self.treeview = treeview
+        self.insert_node(treeview, '', ROOT_PATH, 'Results', True)
+        treeview.bind("<<TreeviewOpen>>", self.on_tree_open)
+
         return treeview, scrollbar
 
+    def reveal_node(self, directory):
+        """
+        insert the ancestors of directory from the root down, then select and show its node
+        """
+        if not directory.startswith(ROOT_PATH):
+            return
+        node = ROOT_PATH
+        for part in directory[len(ROOT_PATH):].rstrip('/').split('/'):
+            self.populate_node(self.treeview, node)
+            self.treeview.item(node, open = True)
+            node += part + '/'
+        if not self.treeview.exists(directory):
+            self.print_on_window("Not in the tree : " + directory)
+            return
+        self.treeview.see(directory)
+        self.treeview.selection_set(directory)
+        self.treeview.focus(directory)
+
     # INFO CREATION METHODS
     def create_info(self):
         Info = Frame(self.window)
@@ -106,6 +192,11 @@ class GUI:
         depositLabel = Label(Info_lab, textvariable=labelText)
         depositLabel.grid(row = 0, column = 1, sticky = W)
 
+        Label(Info_lab, text="Statistiques : ").grid(row = 1, column = 0, sticky = NW, ipadx = 100)
+
+        self.statsText = StringVar()
+        Label(Info_lab, textvariable=self.statsText, justify = LEFT, wraplength = 450).grid(row = 1, column = 1, columnspan = 2, sticky = W)
+
         Label(Info_lab, justify = LEFT, text="Région fonctionnelle choisie : ").grid(row = 4, column = 0, sticky = W, ipadx = 100, ipady = 30)
         return Info, Info_lab, labelText, depositLabel
 
@@ -130,6 +221,7 @@ class GUI:
     def create_region_menu(self):
         OptionList = [
         "Aucun",
+        "Toutes",
         "CDS",
         "centromere",
         "intron",
@@ -155,133 +247,386 @@ class GUI:
         run_search.grid(row = 5, sticky = 'se', column = 2, ipadx = 20, pady = 30, padx = 30)
         return variable, menu, run_search, OptionList
 
+    # TAXID ENTRY CREATION
+    def create_taxid_entry(self):
+        Label(self.Info_lab, justify = LEFT, text="TaxID ou clade:ID : ").grid(row = 2, column = 0, sticky = W, ipadx = 100)
+        taxid_text = StringVar(self.Info_lab)
+        taxid_entry = Entry(self.Info_lab, textvariable = taxid_text)
+        taxid_entry.grid(row = 2, column = 1, sticky = W)
+        return taxid_text, taxid_entry
+
     # RESET BUTTON CREATION
     def create_reset_button(self):
         reset_button = Button(self.Info_lab, text ="Reset Tree", command = self.reset_button_callback, relief = RIDGE, borderwidth=1)
         reset_button.grid(row = 7, sticky = 'se', column = 2, ipadx = 20, pady = 30, padx = 30)
         return reset_button
 
+    # REFRESH BUTTON CREATION
+    def create_refresh_button(self):
+        refresh_button = Button(self.Info_lab, text ="Refresh Tree", command = self.refresh_button_callback, relief = RIDGE, borderwidth=1)
+        refresh_button.grid(row = 7, sticky = 'se', column = 1, ipadx = 20, pady = 30, padx = 30)
+        return refresh_button
+
+    # OFFLINE BUTTON CREATION
+    def create_offline_button(self):
+        offline = IntVar(self.Info_lab)
+        offline.set(0)
+        offline_button = Checkbutton(self.Info_lab, text ="Offline (cache only)", variable = offline)
+        offline_button.grid(row = 6, sticky = 'e', column = 2, padx = 30)
+        return offline, offline_button
+
+    # PACKED BUTTON CREATION
+    def create_packed_button(self):
+        packed = IntVar(self.Info_lab)
+        packed.set(0)
+        packed_button = Checkbutton(self.Info_lab, text ="Packed 2-bit files", variable = packed)
+        packed_button.grid(row = 6, sticky = 'w', column = 1)
+        return packed, packed_button
+
+    # CHANGED ONLY BUTTON CREATION
+    def create_changed_only_button(self):
+        changed_only = IntVar(self.Info_lab)
+        changed_only.set(0)
+        changed_only_button = Checkbutton(self.Info_lab, text ="Changed records only", variable = changed_only)
+        changed_only_button.grid(row = 6, sticky = 'w', column = 0, padx = 30)
+        return changed_only, changed_only_button
+
+    # CANCEL BUTTON CREATION
+    def create_cancel_button(self):
+        cancel_button = Button(self.Info_lab, text ="Cancel", command = self.cancel_button_callback, relief = RIDGE, borderwidth=1, state = DISABLED)
+        cancel_button.grid(row = 5, sticky = 'se', column = 1, ipadx = 20, pady = 30, padx = 30)
+        return cancel_button
+
+    # PROGRESS BAR CREATION
+    def create_progress(self):
+        progress_frame = Frame(self.window)
+        progress_frame.pack(side=BOTTOM, fill=X)
+        progress = ttk.Progressbar(progress_frame, orient = HORIZONTAL,
+            length = 1200, mode = 'determinate')
+        progress.pack(side=BOTTOM)
+        progress_text = StringVar()
+        Label(progress_frame, textvariable = progress_text).pack(side=BOTTOM)
+        return progress_frame, progress, progress_text
+
     # FEATURES METHODS
 
     def update_tree_tags(self):
         for node in self.tree_array:
-            current_path = self.get_path(node).replace("Other1", "Other").replace("unclassified1", "unclassified").replace("uncultured_bacterium1", "uncultured_bacterium")
-            turn_to_green = True
-            is_leaf = False
-            for (index, name, path, NC_list) in self.organism_df.itertuples():
-                path_full = path + name.replace(" ", "_").replace("[", "_").replace("]", "_").replace(":", "_") + '/'
-                if path_full == current_path:
-                    is_leaf = True
-                    if os.listdir(path_full) == []:
-                        self.treeview.item(node, tags="not_dl")
-                    else:
-                        self.treeview.item(node, tags="dl")
-                    break
-                elif current_path in path_full:
-                    if os.listdir(path_full) == []:
-                        turn_to_green = False
-            if is_leaf:
-                continue
-
-            if turn_to_green:
-                self.treeview.item(node, tags="dl")
-            else:
-                self.treeview.item(node, tags="not_dl")
-
-            self.window.update()
+            self.tag_node(node)
         self.print_on_window("Tree updated")
 
+    def tag_node(self, node):
+        if self.status is not None and self.status.is_downloaded(node):
+            self.treeview.item(node, tags="dl")
+        else:
+            self.treeview.item(node, tags="not_dl")
+
+    def status_worker(self):
+        """
+        look at every organism directory once, runs in a thread at start-up
+        """
+        store = OrganismStore(self.store.filename)
+        self.events.put(("status_ready", build_status(store)))
+        store.close()
+
+    def stats_worker(self):
+        """
+        compute the region statistics of the selected nodes, runs in a thread.
+        Only the last node asked is computed, files unchanged since a
+        previous scan are not read again
+        """
+        store = OrganismStore(self.store.filename)
+        cache = StatsCache()
+        while True:
+            node = self.stats_requests.get()
+            while not self.stats_requests.empty():
+                node = self.stats_requests.get()
+            try:
+                lines = format_rollup(*cache.rollup(store, node))
+            except Exception as error:
+                lines = ["Statistiques indisponibles : " + str(error)]
+            self.events.put(("stats_ready", node, lines))
+
+    def search_index_worker(self, main_store):
+        """
+        index the organism names and accessions of main_store for the search box, runs in a thread
+        """
+        store = OrganismStore(main_store.filename)
+        self.events.put(("search_index_ready", main_store, SearchIndex(store)))
+        store.close()
+
+    def refresh_status(self, directory):
+        """
+        update the status of an organism directory, only its node and
+        ancestors are tagged again
+        """
+        if self.status is None:
+            return
+        for prefix in self.status.set_downloaded(directory, has_downloads(directory)):
+            if self.treeview.exists(prefix):
+                self.tag_node(prefix)
+
     def print_on_window(self, t): #affiche t dans les logs
         time_string = time.strftime('%H:%M:%S')
         self.log_text.insert(INSERT, time_string + ' : ' + t + "\n")
         self.log_text.yview(END)
 
+    # BACKGROUND WORK METHODS
+
+    def is_busy(self):
+        return self.worker is not None and self.worker.is_alive()
+
+    def start_worker(self, target, *args):
+        """
+        run target in a worker thread, it reports through self.events
+        """
+        self.cancel_event.clear()
+        (self.progress_frame, self.progress, self.progress_text) = self.create_progress()
+        self.start_time = time.time()
+        self.worker = threading.Thread(target = target, args = args, daemon = True)
+        self.worker.start()
+
+    def stop_worker(self):
+        self.progress_frame.destroy()
+        self.progress = None
+        self.cancel_button.configure(state = DISABLED)
+
+    def poll_events(self):
+        """
+        handle the events of the worker thread, log lines are inserted in one batch
+        """
+        lines = []
+        for i in range(MAX_EVENTS):
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] == "log":
+                lines.append(time.strftime('%H:%M:%S') + ' : ' + event[1] + "\n")
+            elif event[0] == "progress" and self.progress is not None:
+                self.progress['value'] = event[1]
+                self.progress_text.set(event[2])
+            elif event[0] == "status_ready":
+                self.status = event[1]
+                self.update_tree_tags()
+            elif event[0] == "organism_done":
+                self.refresh_status(event[1])
+            elif event[0] == "search_index_ready":
+                # an index of the store before a reset is dropped
+                if event[1] is self.store:
+                    self.search_index = event[2]
+                    self.on_search_changed()
+            elif event[0] == "stats_ready":
+                if event[1] == self.selected_node:
+                    self.statsText.set("\n".join(event[2]))
+            elif event[0] == "search_done":
+                self.search_finished(*event[1:])
+            elif event[0] == "reset_done":
+                self.reset_finished(event[1])
+        if len(lines) != 0:
+            self.log_text.insert(INSERT, ''.join(lines))
+            self.log_text.yview(END)
+        self.window.after(POLL_DELAY, self.poll_events)
+
+    def log(self, t):
+        """
+        print_on_window from the worker thread
+        """
+        self.events.put(("log", t))
+
+    def cancel_button_callback(self):
+        if self.is_busy():
+            self.cancel_event.set()
+            self.print_on_window("Cancelling, waiting for the running downloads")
+
+    # SEARCH BOX METHODS
+
+    def on_search_changed(self, *args):
+        """
+        list the organisms matching the search box, the index answers in a few milliseconds
+        """
+        query = self.search_text.get()
+        self.search_matches.delete(0, END)
+        self.match_directories = []
+        if query.strip() == '':
+            return
+        if self.search_index is None:
+            self.search_matches.insert(END, "Indexation en cours...")
+            return
+        for (name, directory, score) in self.search_index.search(query, NB_MATCHES):
+            self.search_matches.insert(END, name + "  (" + directory[len(ROOT_PATH):].rstrip('/').rpartition('/')[0] + ")")
+            self.match_directories.append(directory)
+
+    def on_match_select(self, event):
+        selection = self.search_matches.curselection()
+        if len(selection) != 0 and selection[0] < len(self.match_directories):
+            self.reveal_node(self.match_directories[selection[0]])
+
+    def on_search_return(self, event):
+        if len(self.match_directories) != 0:
+            self.reveal_node(self.match_directories[0])
+
     def callback(self, *args): # fonction pour executer du code pour le menu, a changer
         self.print_on_window("The selected item is " + self.selected_region.get())
 
-    def get_path(self, current_item):
-        path = '/' + current_item + '/'
-        while len(self.treeview.parent(current_item)) != 0 :
-            parent = self.treeview.parent(current_item)
-            current_item = parent
-            path = '/' + parent + path
-        return ('..' + path)
+    def get_selected_regions(self):
+        """
+        return the feature keys to extract, every region of the menu for "Toutes"
+        """
+        if self.selected_region.get() == "Toutes":
+            return self.OptionList_region[2:]
+        return [self.selected_region.get()]
 
     def search_button_callback(self): # Fonction boutton
-        if self.is_in_critical_section:
+        if self.is_busy():
             return
 
         self.print_on_window("Searching")
-        self.is_in_critical_section = True
-        if self.labelText.get() == 'Aucun' :
+        taxid = self.taxid_text.get().strip()
+        if self.selected_node is None and taxid == '':
             self.print_on_window("No organism selected")
-            self.window.update()
-            self.is_in_critical_section = False
             return
         elif self.selected_region.get() == 'Aucun':
             self.print_on_window("No functional region selected")
-            self.window.update()
-            self.is_in_critical_section = False
             return
-        else :
-            current_path = self.get_path(self.labelText.get()).replace("Other1", "Other").replace("unclassified1", "unclassified").replace("uncultured_bacterium1", "uncultured_bacterium")
+        fetch.offline = self.offline.get() == 1
+        fetch.output_format = "packed" if self.packed.get() == 1 else "fasta"
+        fetch.check_versions = self.changed_only.get() == 1
+        if taxid != '':
+            # a taxonomy or clade ID takes precedence over the tree selection
+            try:
+                (taxid, clade_id) = parse_selection(taxid)
+            except ValueError:
+                self.print_on_window("Invalid taxonomy ID [" + taxid + "]")
+                return
+            # the clade index is opened, and built the first time, by the worker
+            organisms = None
+            clade = (taxid, clade_id)
+        else:
+            current_path = self.selected_node
             self.print_on_window(current_path)
-            c = 0
-            nb_region_found = 0
-            for (index, name, path, NC_list) in self.organism_df.itertuples():
-                path_full = path + name.replace(" ", "_").replace("[", "_").replace("]", "_").replace(":", "_") + '/'
-                nb_new_region_found = -1
-                if path_full == current_path:
-                    c += 1
-                    self.window.update()
-                    nb_new_region_found = fetch.load_data_from_NC(index, name, path, NC_list, self.selected_region.get())
-                    if nb_new_region_found == 0:
-                        self.print_on_window("Selected functional region [" + self.selected_region.get() + "] not found for organism [" + name + "]")
-                    else:
-                        self.print_on_window("[" + name + "] downloaded ")
-                    self.window.update()
-                    nb_region_found += nb_new_region_found
-                    break
-                elif current_path in path_full:
-                    c += 1
-                    self.window.update()
-                    nb_new_region_found = fetch.load_data_from_NC(index, name, path, NC_list, self.selected_region.get())
-                if nb_new_region_found != -1:
-                    if nb_new_region_found == 0:
-                        self.print_on_window("Selected functional region [" + self.selected_region.get() + "] not found for organism [" + name + "]")
-                    else:
-                        self.print_on_window("[" + name + "] downloaded ")
-                    self.window.update()
+            organisms = list(self.store.organisms_under(current_path))
+            clade = None
+        self.cancel_button.configure(state = NORMAL)
+        self.start_worker(self.search_worker, organisms, self.get_selected_regions(), self.selected_region.get(), clade)
+
+    def search_worker(self, organisms, regions, region_label, clade = None):
+        """
+        download the organisms, or those of the (taxid, clade_id) clade,
+        and extract their regions, runs in the worker thread
+        """
+        if clade is not None:
+            try:
+                if self.clades is None:
+                    self.clades = CladeIndex()
+                organisms = self.clades.organisms(self.store, *clade)
+            except Exception as error:
+                self.log("Clade index unavailable : " + str(error))
+                organisms = []
+            self.log(str(len(organisms)) + " organisms under " + ("clade:" + str(clade[1]) if clade[1] is not None else str(clade[0])))
+        cache_stats = fetch.get_record_cache().stats()
+        bytes_start = fetch.entrez.bytes_received
+        recorder = metrics.start_run()
+        directories = {name: organism_dir(name, path) for (index, name, path, NC_list) in organisms}
+        c = 0
+        nb_region_found = 0
+        try:
+            # downloads run concurrently, regions are extracted as organisms complete
+            for (name, nb_new_region_found) in fetch.fetch_organisms(organisms, regions, self.scheduler, self.cancel_event):
+                c += 1
+                if nb_new_region_found is None:
+                    self.log("Download failed for organism [" + name + "]")
+                elif nb_new_region_found == 0:
+                    self.log("Selected functional region [" + region_label + "] not found for organism [" + name + "]")
+                else:
+                    self.log("[" + name + "] downloaded ")
                     nb_region_found += nb_new_region_found
-            if nb_region_found == 0:
-                self.window.update()
-                self.is_in_critical_section = False
-                return
-            if c != 0:
-                self.update_tree_tags()
+                if nb_new_region_found is not None:
+                    # the files of a previous run may have been removed
+                    self.events.put(("organism_done", directories[name]))
+                elapsed = time.time() - self.start_time
+                eta = elapsed / c * (len(organisms) - c)
+                self.events.put(("progress", c / len(organisms) * 100,
+                                 str(c) + " / " + str(len(organisms)) + " organisms, "
+                                 + "%.1f MB" % ((fetch.entrez.bytes_received - bytes_start) / 1e6)
+                                 + ", ETA " + time.strftime('%H:%M:%S', time.gmtime(eta))))
+        except Exception as error:
+            self.log("Search failed : " + str(error))
+        new_cache_stats = fetch.get_record_cache().stats()
+        self.log("Record cache : " + str(new_cache_stats["hits"] - cache_stats["hits"]) + " hits, " + str(new_cache_stats["misses"] - cache_stats["misses"]) + " misses, " + str(new_cache_stats["stored"] - cache_stats["stored"]) + " downloaded")
+        # time per stage, written to ../metrics/gui.jsonl and gui.prom
+        for line in recorder.report():
+            self.log(line)
+        try:
+            recorder.write(metrics.METRICS_PATH + "gui")
+        except OSError as error:
+            self.log("Metrics not written : " + str(error))
+        self.events.put(("search_done", c, nb_region_found))
+
+    def search_finished(self, c, nb_region_found):
+        self.stop_worker()
+        if self.cancel_event.is_set():
+            self.print_on_window("Research cancelled")
+        if nb_region_found != 0 and c != 0:
             self.print_on_window(str(c) + " items downloaded")
-
-        self.window.update()
-
         self.print_on_window("Research finished")
-        self.is_in_critical_section = False
+        if self.selected_node is not None:
+            self.stats_requests.put(self.selected_node)
 
     def reset_button_callback(self):
-        if self.is_in_critical_section: return
-        progress = ttk.Progressbar(self.window, orient = HORIZONTAL,
-            length = 1200, mode = 'determinate')
-        progress.pack(side=BOTTOM)
+        if self.is_busy(): return
         self.print_on_window("Reset Tree starting")
-        self.is_in_critical_section = True
-        self.window.update()
-        # reset file tree
-        self.organism_df = fetch.reset_tree(progress, self.window)
+        self.start_worker(self.reset_worker)
+
+    def reset_worker(self):
+        """
+        rebuild the organism index, runs in the worker thread
+        """
+        def progress(value):
+            self.events.put(("progress", value, "Reset Tree : %d %%" % value))
+        try:
+            store = fetch.reset_tree(progress)
+            self.events.put(("reset_done", (store, build_status(store))))
+        except Exception as error:
+            self.log("Reset Tree failed : " + str(error))
+            self.events.put(("reset_done", None))
+
+    def refresh_button_callback(self):
+        if self.is_busy(): return
+        self.print_on_window("Refresh Tree starting")
+        self.start_worker(self.refresh_worker)
+
+    def refresh_worker(self):
+        """
+        update the organism index to the genome reports keeping the downloads, runs in the worker thread
+        """
+        def progress(value):
+            self.events.put(("progress", value, "Refresh Tree : %d %%" % value))
+        try:
+            (store, summary) = fetch.refresh_tree(progress)
+            self.log("Refresh : " + ", ".join(str(len(summary[change])) + " " + change for change in ("added", "removed", "moved", "changed", "restored", "failed")))
+            if len(summary["removed"]) != 0:
+                self.log("Downloads of removed organisms moved to " + fetch.RETIRED_PATH)
+            self.events.put(("reset_done", (store, build_status(store))))
+        except Exception as error:
+            self.log("Refresh Tree failed : " + str(error))
+            self.events.put(("reset_done", None))
+
+    def reset_finished(self, result):
+        self.stop_worker()
+        if result is None:
+            return
+        (self.store, self.status) = result
+        self.search_index = None
+        threading.Thread(target = self.search_index_worker, args = (self.store,), daemon = True).start()
         #reset treeview
+        self.tree_array = []
+        self.selected_node = None
+        self.labelText.set('Aucun')
         (self.treeview, self.scrollbar) = self.create_tree()
         self.treeview.bind("<<TreeviewSelect>>", self.on_tree_select)
+        self.update_tree_tags()
         self.print_on_window("Reset Tree finished")
-        progress.destroy()
-        self.is_in_critical_section = False
 
     def on_tree_select(self, event): #on recupere l'organisme dans item
             self.print_on_window("Selected items:")
@@ -289,6 +634,9 @@ class GUI:
                 item_text = self.treeview.item(item,"text")
                 self.print_on_window("Selected items : [" + item_text + "]")
                 self.labelText.set(item_text)
+                self.selected_node = item
+                self.statsText.set("...")
+                self.stats_requests.put(item)
 
 if __name__ == "__main__":
     App = GUI()
\ No newline at end of file
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+download and extract functional regions without the GUI
+
+    python3 batch.py Bacteria/Proteobacteria --region CDS --region tRNA
+    python3 batch.py --organism "Escherichia coli" --organisms list.txt --region rRNA
+    python3 batch.py --taxid 1224 --clade 19180 --region CDS
+    python3 batch.py Eukaryota --level Chromosome --min-chromosomes 2 --max-size 500 --region rRNA
+    python3 batch.py Archaea --region CDS --changed-only
+
+Completed accessions and organisms are recorded in a journal, a job
+started again with the same journal skips the organisms already extracted.
+With --changed-only every selected organism is looked at again, but only
+the records whose version changed upstream are downloaded and only their
+organisms extracted again.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import entrez
+import fetch
+import metrics
+import reports
+from clades import CladeIndex
+from scheduler import Scheduler
+
+JOURNAL_PATH = "../journal/batch.jsonl"
+
+class Journal:
+    """
+    append-only JSON lines journal of a batch job, each line is flushed
+    as soon as it is written so a killed job loses nothing
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.downloaded = set()
+        # (organism, output format) -> set of regions extracted
+        self.extracted = {}
+        if os.path.exists(filename):
+            with open(filename) as f:
+                for row in f:
+                    try:
+                        entry = json.loads(row)
+                    except ValueError:
+                        # last line of a killed job
+                        continue
+                    self._apply(entry)
+        elif os.path.dirname(filename) and not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        self.out = open(filename, 'a')
+
+    def _apply(self, entry):
+        if entry["event"] == "downloaded":
+            self.downloaded.add(entry["accession"])
+        elif entry["event"] == "extracted":
+            # journals written before the format was recorded only hold FASTA
+            self.extracted.setdefault((entry["organism"], entry.get("format", "fasta")), set()).update(entry["regions"])
+
+    def write(self, entry):
+        entry["time"] = time.time()
+        self.out.write(json.dumps(entry) + "\n")
+        self.out.flush()
+        self._apply(entry)
+
+    def is_done(self, name, regions, format):
+        """
+        return True if regions of the organism were all extracted in format
+        """
+        return set(regions) <= self.extracted.get((name, format), set())
+
+    def on_downloaded(self, name, NC_list):
+        for NC in NC_list:
+            if NC not in self.downloaded:
+                self.write({"event": "downloaded", "organism": name, "accession": NC})
+
+    def close(self):
+        self.out.close()
+
+def select_organisms(store, prefixes, names, taxids = (), clade_ids = ()):
+    """
+    return the (index, name, path, NC_list) of the organisms under the path
+    prefixes ('Bacteria/Proteobacteria'), of the organisms named and of the
+    organisms under the taxonomy and clade IDs
+    """
+    selected = {}
+    if len(taxids) != 0 or len(clade_ids) != 0:
+        clades = CladeIndex()
+        for taxid in taxids:
+            for organism in clades.organisms(store, taxid = taxid):
+                selected[organism[1]] = organism
+        for clade_id in clade_ids:
+            for organism in clades.organisms(store, clade_id = clade_id):
+                selected[organism[1]] = organism
+        clades.close()
+    for prefix in prefixes:
+        prefix = '../Results/' + prefix.strip('/') + '/'
+        for organism in store.organisms_under(prefix):
+            selected[organism[1]] = organism
+    for name in names:
+        organism = store.organism(name)
+        if organism is None:
+            print("Unknown organism : [" + name + "]", file = sys.stderr)
+            continue
+        selected[name] = organism
+    return list(selected.values())
+
+def filter_assemblies(organisms, args):
+    """
+    keep the organisms whose eukaryotes.txt assembly matches the size, GC%,
+    level and chromosome criteria of args
+    """
+    assemblies = reports.select_assemblies(reports.load_eukaryotes(), args.min_size, args.max_size, args.min_gc, args.max_gc,
+                                           args.level, args.min_chromosomes, args.max_chromosomes)
+    names = set(assemblies["#Organism/Name"])
+    return [organism for organism in organisms if organism[1] in names]
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("prefix", nargs = "*", help = "clade path under Results, e.g. Bacteria/Proteobacteria")
+    parser.add_argument("--organism", action = "append", default = [], help = "organism name, may be repeated")
+    parser.add_argument("--organisms", metavar = "FILE", help = "file of organism names, one per line")
+    parser.add_argument("--taxid", type = int, action = "append", default = [], help = "taxonomy ID (assembly or phylum), may be repeated")
+    parser.add_argument("--clade", type = int, action = "append", default = [], help = "clade ID of GENOME_REPORTS/CLADES, may be repeated")
+    parser.add_argument("--region", action = "append", required = True, help = "feature key to extract (CDS, tRNA, ...), may be repeated")
+    assembly = parser.add_argument_group("assembly filters", "keep the organisms whose eukaryotes.txt assembly matches")
+    assembly.add_argument("--min-size", type = float, help = "minimum assembly size in Mb")
+    assembly.add_argument("--max-size", type = float, help = "maximum assembly size in Mb")
+    assembly.add_argument("--min-gc", type = float, help = "minimum GC%%")
+    assembly.add_argument("--max-gc", type = float, help = "maximum GC%%")
+    assembly.add_argument("--level", action = "append", help = "assembly level (Chromosome, Complete Genome, Scaffold, Contig), may be repeated")
+    assembly.add_argument("--min-chromosomes", type = int, help = "minimum number of chromosomes")
+    assembly.add_argument("--max-chromosomes", type = int, help = "maximum number of chromosomes")
+    parser.add_argument("--packed", action = "store_true", help = "write 2-bit packed .pack files instead of FASTA")
+    parser.add_argument("--journal", default = JOURNAL_PATH, help = "journal file (default " + JOURNAL_PATH + ")")
+    parser.add_argument("--metrics", default = metrics.METRICS_PATH + "batch", metavar = "PREFIX",
+                        help = "stage metrics written to PREFIX.jsonl and PREFIX.prom (default " + metrics.METRICS_PATH + "batch)")
+    parser.add_argument("--restart", action = "store_true", help = "ignore the journal and extract every organism again")
+    parser.add_argument("--changed-only", action = "store_true",
+                        help = "ignore the journal, check the record versions with esummary and only extract the organisms that changed")
+    parser.add_argument("--workers", type = int, default = 4, help = "concurrent downloads")
+    parser.add_argument("--processes", type = int, default = fetch.extract_processes,
+                        help = "processes parsing and extracting records (default one per CPU)")
+    parser.add_argument("--api-key", help = "NCBI API key, raises the rate limit to 10 requests/s")
+    parser.add_argument("--email", help = "contact email sent to NCBI")
+    parser.add_argument("--offline", action = "store_true", help = "only use the records already cached")
+    args = parser.parse_args()
+
+    names = list(args.organism)
+    if args.organisms:
+        with open(args.organisms) as f:
+            names += [row.strip() for row in f if row.strip()]
+    if len(args.prefix) == 0 and len(names) == 0 and len(args.taxid) == 0 and len(args.clade) == 0:
+        parser.error("give a clade path prefix, organism names, taxonomy or clade IDs")
+    if args.api_key:
+        entrez.set_api_key(args.api_key)
+    if args.email:
+        entrez.email = args.email
+    fetch.offline = args.offline
+    fetch.extract_processes = args.processes
+    fetch.output_format = "packed" if args.packed else "fasta"
+    fetch.check_versions = args.changed_only
+
+    store = fetch.load_store()
+    organisms = select_organisms(store, args.prefix, names, args.taxid, args.clade)
+    if any(value is not None for value in (args.min_size, args.max_size, args.min_gc, args.max_gc,
+                                           args.level, args.min_chromosomes, args.max_chromosomes)):
+        organisms = filter_assemblies(organisms, args)
+    if args.restart and os.path.exists(args.journal):
+        os.remove(args.journal)
+    journal = Journal(args.journal)
+    todo = [organism for organism in organisms if args.changed_only or not journal.is_done(organism[1], args.region, fetch.output_format)]
+    print(str(len(organisms)) + " organisms selected, " + str(len(organisms) - len(todo)) + " already done")
+
+    nb_done = nb_failed = nb_region_found = 0
+    recorder = metrics.start_run()
+    try:
+        for (name, nb_new_region_found) in fetch.fetch_organisms(todo, args.region, Scheduler(workers = args.workers),
+                                                                 on_downloaded = journal.on_downloaded):
+            if nb_new_region_found is None:
+                nb_failed += 1
+                continue
+            journal.write({"event": "extracted", "organism": name, "regions": sorted(args.region), "format": fetch.output_format,
+                           "nb_regions": nb_new_region_found})
+            nb_done += 1
+            nb_region_found += nb_new_region_found
+            print("[" + str(nb_done + nb_failed) + " / " + str(len(todo)) + "] " + name + " : " + str(nb_new_region_found) + " regions")
+    finally:
+        journal.close()
+        recorder.write(args.metrics)
+        for line in recorder.report():
+            print(line)
+    print(str(nb_done) + " organisms extracted, " + str(nb_region_found) + " regions, " + str(nb_failed) + " failed")
+    return 1 if nb_failed != 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+benchmark the hot paths on synthetic genome reports and a mock Entrez server
+
+    python3 bench.py                        1k and 10k organisms
+    python3 bench.py --scale 100000 --features 200
+
+Every stage is timed, its peak Python heap traced and the growth of the
+process RSS sampled, which also counts the memory libxml2 and SQLite
+allocate outside the Python heap. The results are appended to
+../bench/results.jsonl with the current commit, and compared to the last
+run of another commit at the same scale.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import entrez
+import fetch
+import status
+from location import extract_regions
+from mock_entrez import MockEntrez, synthetic_record
+
+RESULTS_PATH = "../bench/results.jsonl"
+# slowdown reported as a regression, stages faster than MIN_SECONDS are noise
+THRESHOLD = 1.2
+MIN_SECONDS = 0.01
+# seconds between two samples of the RSS of the process
+RSS_INTERVAL = 0.005
+
+KINGDOMS = ["Archaea", "Bacteria", "Eukaryota", "Viruses"]
+IDS_FILES = ["Archaea.ids", "Bacteria.ids", "Eukaryota.ids", "Viruses.ids"]
+
+def synthetic_reports(path, nb_organisms, seed = 0):
+    """
+    write overview.txt and IDS files of nb_organisms organisms under path,
+    with 1 to 3 NC accessions each and a few duplicated overview rows
+    """
+    generator = random.Random(seed)
+    os.makedirs(path + "IDS/")
+    nb_accessions = 0
+    ids_files = [open(path + "IDS/" + ids, 'w') for ids in IDS_FILES]
+    with open(path + "overview.txt", 'w') as overview:
+        overview.write("#Organism/Name\tKingdom\tGroup\tSubGroup\tSize (Mb)\tGC%\n")
+        for i in range(nb_organisms):
+            name = "Organism %d str. %d" % (i, generator.randint(1, 99))
+            kingdom = generator.randrange(len(KINGDOMS))
+            row = "%s\t%s\tGroup %d\tSub/group %d\t%.2f\t%.1f\n" % (
+                name, KINGDOMS[kingdom], i % 50, i % 500, generator.uniform(0.5, 10), generator.uniform(25, 75))
+            overview.write(row)
+            if generator.random() < 0.05:
+                overview.write(row)
+            for j in range(generator.randint(1, 3)):
+                nb_accessions += 1
+                ids_files[kingdom].write("%d\tNC_%06d\t%d\t0\tCP%06d\t%s\n" % (i, nb_accessions, nb_accessions, nb_accessions, name))
+            # accessions the organism index ignores
+            if generator.random() < 0.3:
+                ids_files[kingdom].write("%d\tNZ_%06d\t0\t0\tAB%06d\t%s\n" % (i, i, i, name))
+    for f in ids_files:
+        f.close()
+
+def synthetic_gbseq(nb_records, length, nb_features):
+    """
+    return a GBSet XML document of nb_records synthetic records
+    """
+    return ("<GBSet>" + ''.join(synthetic_record("NC_%06d" % i, length, nb_features) for i in range(nb_records))
+            + "</GBSet>").encode()
+
+def rss():
+    """
+    return the resident set size of the process in bytes, None if unknown
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # peak so far, only its growth is seen: kB on Linux, bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+class Stages:
+    """
+    time, peak Python heap and peak RSS growth of the stages run through measure
+    """
+    def __init__(self):
+        self.results = []
+
+    @contextlib.contextmanager
+    def measure(self, stage, scale):
+        rss_start = rss()
+        rss_peak = [rss_start or 0]
+        done = threading.Event()
+        def sample():
+            while not done.wait(RSS_INTERVAL):
+                rss_peak[0] = max(rss_peak[0], rss())
+        sampler = threading.Thread(target = sample, daemon = True)
+        if rss_start is not None:
+            sampler.start()
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            # the extraction prints every NC
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                yield
+        finally:
+            seconds = time.perf_counter() - start
+            heap = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            done.set()
+        if rss_start is None:
+            rss_mb = None
+        else:
+            sampler.join()
+            rss_mb = (max(rss_peak[0], rss()) - rss_start) / 1e6
+        self.results.append({"stage": stage, "scale": scale, "seconds": seconds, "heap_mb": heap / 1e6, "rss_mb": rss_mb})
+        print("%-20s %8d %10.3f s %10.1f MB %10s" % (stage, scale, seconds, heap / 1e6, "-" if rss_mb is None else "%.1f MB" % rss_mb))
+
+def run(stages, nb_organisms, nb_records, length, nb_features, nb_fetched):
+    """
+    run every stage at one scale in a temporary tree, the relative
+    ../GENOME_REPORTS, ../Results, ../pickle and ../cache paths of the
+    modules point into it
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as root:
+        synthetic_reports(root + "/GENOME_REPORTS/", nb_organisms)
+        os.makedirs(root + "/script")
+        os.chdir(root + "/script")
+        try:
+            with stages.measure("reset_tree", nb_organisms):
+                store = fetch.reset_tree()
+            store.close()
+            with stages.measure("load_store", nb_organisms):
+                store = fetch.load_store()
+            with stages.measure("load_df_from_pickle", nb_organisms):
+                fetch.load_df_from_pickle()
+            with stages.measure("build_status", nb_organisms):
+                tree_status = status.build_status(store)
+            directories = sorted(tree_status.total)
+            organisms = list(store.organisms())
+            with stages.measure("update_tree_tags", nb_organisms):
+                for (index, name, path, NC_list) in organisms[:1000]:
+                    tree_status.set_downloaded(fetch.organism_dir(name, path))
+                for directory in directories:
+                    tree_status.is_downloaded(directory)
+
+            document = synthetic_gbseq(nb_records, length, nb_features)
+            with stages.measure("parse_records", nb_records * nb_features):
+                records = list(entrez.iter_records(io.BytesIO(document)))
+            with stages.measure("extract_regions", nb_records * nb_features):
+                for record in records:
+                    for region in extract_regions(record.sequence.encode(), record.features):
+                        pass
+            del document, records
+
+            server = MockEntrez(length = length, nb_features = nb_features).start()
+            entrez.eutils_url = server.url
+            entrez.rate_limiter.rate = entrez.rate_limiter.capacity = 1000
+            fetch.record_cache = None
+            with stages.measure("fetch_organisms", nb_fetched):
+                for result in fetch.fetch_organisms(organisms[:nb_fetched], ["CDS", "tRNA", "rRNA"], fetch.Scheduler(backoff = 0.1)):
+                    pass
+            server.shutdown()
+            fetch.get_record_cache().close()
+            fetch.record_cache = None
+            store.close()
+        finally:
+            os.chdir(cwd)
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def load_results(filename):
+    if not os.path.exists(filename):
+        return []
+    with open(filename) as f:
+        return [json.loads(row) for row in f if row.strip()]
+
+def compare(results, previous, commit):
+    """
+    print the stages slower than the last run of another commit by more than THRESHOLD
+    return the number of regressions
+    """
+    last = {}
+    for result in previous:
+        if result["commit"] != commit:
+            last[(result["stage"], result["scale"])] = result
+    nb_regressions = 0
+    for result in results:
+        reference = last.get((result["stage"], result["scale"]))
+        if reference is None or result["seconds"] - reference["seconds"] < MIN_SECONDS:
+            continue
+        ratio = result["seconds"] / max(reference["seconds"], 1e-9)
+        if ratio > THRESHOLD:
+            nb_regressions += 1
+            print("regression %-20s %8d : %.3f s -> %.3f s (x%.2f since %s)"
+                  % (result["stage"], result["scale"], reference["seconds"], result["seconds"], ratio, reference["commit"]))
+    return nb_regressions
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type = int, nargs = "+", default = [1000, 10000], help = "numbers of organisms of the synthetic reports")
+    parser.add_argument("--records", type = int, default = 20, help = "synthetic GBSeq records parsed")
+    parser.add_argument("--length", type = int, default = 20000, help = "length of a synthetic record")
+    parser.add_argument("--features", type = int, default = 500, help = "features of a synthetic record")
+    parser.add_argument("--fetched", type = int, default = 20, help = "organisms downloaded from the mock server")
+    parser.add_argument("--output", default = RESULTS_PATH, help = "results file (default " + RESULTS_PATH + ")")
+    parser.add_argument("--no-save", action = "store_true", help = "do not record the results")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    stages = Stages()
+    print("%-20s %8s %12s %13s %13s" % ("stage", "scale", "time", "python heap", "peak RSS"))
+    for nb_organisms in args.scale:
+        run(stages, nb_organisms, args.records, args.length, args.features, min(args.fetched, nb_organisms))
+    commit = current_commit()
+    nb_regressions = compare(stages.results, load_results(output), commit)
+    if not args.no_save:
+        if not os.path.exists(os.path.dirname(output)):
+            os.makedirs(os.path.dirname(output))
+        with open(output, 'a') as f:
+            for result in stages.results:
+                result.update({"commit": commit, "time": time.time()})
+                f.write(json.dumps(result) + "\n")
+    return 1 if nb_regressions != 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+import gzip
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+CACHE_PATH = "../cache"
+# default size cap of the compressed records
+MAX_SIZE = 2 * 1024 ** 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS record (
+    version TEXT PRIMARY KEY,
+    accession TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    fetched REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS record_accession ON record(accession);
+CREATE INDEX IF NOT EXISTS record_last_access ON record(last_access);
+"""
+
+class RecordCache:
+    """
+    on-disk cache of raw GBSeq records. Records are stored gzip compressed
+    under the sha256 of their content and indexed by accession.version,
+    the least recently used ones are evicted above max_size bytes.
+    In offline mode nothing is downloaded, only cached records are served.
+    """
+    def __init__(self, root = CACHE_PATH, max_size = MAX_SIZE, offline = False):
+        self.root = root
+        self.max_size = max_size
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.lock = threading.Lock()
+        if not os.path.exists(os.path.join(root, "objects")):
+            os.makedirs(os.path.join(root, "objects"))
+        self.connection = sqlite3.connect(os.path.join(root, "index.db"), check_same_thread = False)
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest + ".xml.gz")
+
+    @property
+    def size(self):
+        with self.lock:
+            # blobs shared by several versions are only counted once
+            return self.connection.execute(
+                "SELECT coalesce(sum(size), 0) FROM (SELECT DISTINCT digest, size FROM record)").fetchone()[0]
+
+    def version_of(self, id):
+        """
+        return the most recently fetched accession.version cached for id
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT version FROM record WHERE version = ? OR accession = ? "
+                "ORDER BY fetched DESC LIMIT 1", (id, id)).fetchone()
+        return row[0] if row is not None else None
+
+    def fetched(self, id):
+        """
+        return the time the most recent record of id was downloaded, None if it is not cached
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT fetched FROM record WHERE version = ? OR accession = ? "
+                "ORDER BY fetched DESC LIMIT 1", (id, id)).fetchone()
+        return row[0] if row is not None else None
+
+    def path(self, id):
+        """
+        return the gzip file holding the raw record of id (accession or
+        accession.version), None if it is not cached
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT version, digest FROM record WHERE version = ? OR accession = ? "
+                "ORDER BY fetched DESC LIMIT 1", (id, id)).fetchone()
+            if row is not None and not os.path.isfile(self._blob_path(row[1])):
+                # blob removed behind our back
+                self.connection.execute("DELETE FROM record WHERE version = ?", (row[0],))
+                self.connection.commit()
+                row = None
+            if row is None:
+                return None
+            with self.connection:
+                self.connection.execute("UPDATE record SET last_access = ? WHERE version = ?", (time.time(), row[0]))
+            return self._blob_path(row[1])
+
+    def open(self, id):
+        """
+        return the raw record of id (accession or accession.version) as an
+        open binary file, None if it is not cached
+        """
+        path = self.path(id)
+        if path is None:
+            return None
+        try:
+            return gzip.open(path, 'rb')
+        except IOError:
+            return None
+
+    def writer(self):
+        """
+        return a RecordWriter streaming a raw record into the cache
+        """
+        return RecordWriter(self)
+
+    def put(self, version, accession, raw):
+        """
+        store the raw record of accession.version
+        """
+        writer = self.writer()
+        writer.write(raw)
+        writer.commit(version, accession)
+
+    def _store(self, version, accession, digest, tmp):
+        # publish the compressed blob written to tmp and index it
+        path = self._blob_path(digest)
+        if os.path.exists(path):
+            os.remove(tmp)
+        else:
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path), exist_ok = True)
+            os.replace(tmp, path)
+        now = time.time()
+        with self.lock:
+            self.stored += 1
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO record (version, accession, digest, size, fetched, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", (version, accession, digest, os.path.getsize(path), now, now))
+            self._evict()
+
+    def _evict(self):
+        total = self.connection.execute(
+            "SELECT coalesce(sum(size), 0) FROM (SELECT DISTINCT digest, size FROM record)").fetchone()[0]
+        if total <= self.max_size:
+            return
+        rows = self.connection.execute("SELECT version, digest, size FROM record ORDER BY last_access").fetchall()
+        # never evict the record that has just been stored
+        for (version, digest, size) in rows[:-1]:
+            with self.connection:
+                self.connection.execute("DELETE FROM record WHERE version = ?", (version,))
+                shared = self.connection.execute("SELECT 1 FROM record WHERE digest = ?", (digest,)).fetchone()
+            if shared is None:
+                try:
+                    os.remove(self._blob_path(digest))
+                except OSError:
+                    pass
+                total -= size
+            if total <= self.max_size:
+                break
+
+    def count(self, hits, misses):
+        """
+        account records asked for that were cached (hits) or had to be downloaded (misses)
+        """
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self):
+        """
+        return the counters: records asked that were cached (hits), records
+        asked but not cached (misses) and records stored after a download
+        """
+        return {"hits": self.hits, "misses": self.misses, "stored": self.stored}
+
+class RecordWriter:
+    """
+    raw record compressed to a temporary file as it is written, so a large
+    record is never held in memory. commit() stores it under the sha256 of
+    its content, abort() drops it
+    """
+    def __init__(self, cache):
+        self.cache = cache
+        self.digest = hashlib.sha256()
+        self.size = 0
+        (fd, self.tmp) = tempfile.mkstemp(suffix = ".tmp", dir = os.path.join(cache.root, "objects"))
+        self.file = os.fdopen(fd, 'wb')
+        self.out = gzip.GzipFile(filename = '', mode = 'wb', compresslevel = 6, fileobj = self.file)
+
+    def write(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        self.out.write(data)
+
+    def _close(self):
+        self.out.close()
+        self.file.close()
+
+    def commit(self, version, accession):
+        """
+        store the record as accession.version
+        """
+        self._close()
+        self.cache._store(version, accession, self.digest.hexdigest(), self.tmp)
+
+    def abort(self):
+        self._close()
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+import sqlite3
+
+CLADES_PATH = "../GENOME_REPORTS/CLADES/"
+IDS_PATH = "../GENOME_REPORTS/IDS/"
+INDEX_PATH = "../pickle/clades.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS phylum (
+    taxid INTEGER PRIMARY KEY,
+    name TEXT,
+    rank TEXT,
+    superkingdom TEXT
+);
+CREATE TABLE IF NOT EXISTS clade (
+    clade_id INTEGER NOT NULL,
+    taxid INTEGER NOT NULL,
+    phylum_taxid INTEGER NOT NULL,
+    bioproject INTEGER,
+    assembly INTEGER,
+    accession TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS clade_clade_id ON clade(clade_id);
+CREATE INDEX IF NOT EXISTS clade_taxid ON clade(taxid);
+CREATE INDEX IF NOT EXISTS clade_phylum_taxid ON clade(phylum_taxid);
+CREATE TABLE IF NOT EXISTS xref (
+    accession TEXT NOT NULL,
+    nc TEXT NOT NULL,
+    taxid INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS xref_accession ON xref(accession);
+CREATE INDEX IF NOT EXISTS xref_taxid ON xref(taxid);
+"""
+
+def _fingerprint():
+    digest = hashlib.sha256()
+    for path in (CLADES_PATH, IDS_PATH):
+        for filename in sorted(os.listdir(path)):
+            stat = os.stat(path + filename)
+            digest.update((filename + str(stat.st_size) + str(stat.st_mtime_ns)).encode())
+    return digest.hexdigest()
+
+class CladeIndex:
+    """
+    index of GENOME_REPORTS/CLADES keyed by taxonomy ID and clade ID, with
+    the GenBank accession -> NC accession cross reference of the IDS files.
+    Built once and rebuilt only when the report files change.
+    """
+    def __init__(self, filename = INDEX_PATH):
+        if os.path.dirname(filename) and not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        self.connection = sqlite3.connect(filename, check_same_thread = False)
+        self.connection.executescript(_SCHEMA)
+        fingerprint = _fingerprint()
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        if row is None or row[0] != fingerprint:
+            self.build(fingerprint)
+
+    def close(self):
+        self.connection.close()
+
+    def build(self, fingerprint):
+        phyla = []
+        with open(CLADES_PATH + "Phyla.txt") as f:
+            next(f)
+            for row in f:
+                parsed_row = row.rstrip('\n').split('\t')
+                phyla.append((int(parsed_row[0]), parsed_row[1], parsed_row[2], parsed_row[3]))
+        clades = []
+        for filename in os.listdir(CLADES_PATH):
+            if not filename.startswith("Clades_"):
+                continue
+            phylum_taxid = int(filename[len("Clades_"):-len(".txt")])
+            with open(CLADES_PATH + filename) as f:
+                next(f)
+                for row in f:
+                    parsed_row = [field.strip() for field in row.rstrip('\n').split('\t')]
+                    if len(parsed_row) < 6:
+                        continue
+                    for accession in parsed_row[5].split(','):
+                        clades.append((int(parsed_row[0]), int(parsed_row[1]), phylum_taxid,
+                                       int(parsed_row[2]), int(parsed_row[4]), accession.strip()))
+        xrefs = []
+        for filename in os.listdir(IDS_PATH):
+            with open(IDS_PATH + filename) as f:
+                for row in f:
+                    parsed_row = row.rstrip('\n').split('\t')
+                    if parsed_row[1][0:2] != 'NC':
+                        continue
+                    xrefs.append((parsed_row[4].split('.')[0], parsed_row[1], int(parsed_row[0])))
+        with self.connection:
+            for table in ("phylum", "clade", "xref"):
+                self.connection.execute("DELETE FROM " + table)
+            self.connection.executemany("INSERT OR REPLACE INTO phylum VALUES (?, ?, ?, ?)", phyla)
+            self.connection.executemany("INSERT INTO clade VALUES (?, ?, ?, ?, ?, ?)", clades)
+            self.connection.executemany("INSERT INTO xref VALUES (?, ?, ?)", xrefs)
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+
+    def accessions(self, taxid = None, clade_id = None):
+        """
+        return the GenBank accessions of a taxonomy ID (assembly or phylum
+        taxid) or of a clade ID
+        """
+        if clade_id is not None:
+            cursor = self.connection.execute("SELECT accession FROM clade WHERE clade_id = ?", (clade_id,))
+        else:
+            cursor = self.connection.execute(
+                "SELECT accession FROM clade WHERE taxid = ? UNION SELECT accession FROM clade WHERE phylum_taxid = ?",
+                (taxid, taxid))
+        return [row[0] for row in cursor]
+
+    def nc_accessions(self, taxid = None, clade_id = None):
+        """
+        return the NC accessions of a taxonomy ID or of a clade ID, through
+        the clade tables and, for a taxonomy ID, the IDS files themselves
+        """
+        if clade_id is not None:
+            cursor = self.connection.execute(
+                "SELECT x.nc FROM clade c JOIN xref x ON x.accession = c.accession WHERE c.clade_id = ?", (clade_id,))
+        else:
+            cursor = self.connection.execute(
+                "SELECT x.nc FROM clade c JOIN xref x ON x.accession = c.accession WHERE c.taxid = ? "
+                "UNION SELECT x.nc FROM clade c JOIN xref x ON x.accession = c.accession WHERE c.phylum_taxid = ? "
+                "UNION SELECT nc FROM xref WHERE taxid = ?", (taxid, taxid, taxid))
+        return sorted(row[0] for row in cursor)
+
+    def organisms(self, store, taxid = None, clade_id = None):
+        """
+        return the (index, name, path, NC_list) of the organisms of store
+        having an NC accession under taxid or clade_id
+        """
+        return store.organisms_with(self.nc_accessions(taxid, clade_id))
+
+def parse_selection(text):
+    """
+    read 'clade:19180' as a clade ID and '1224' as a taxonomy ID
+    return (taxid, clade_id)
+    """
+    text = text.strip()
+    if text.startswith("clade:"):
+        return None, int(text[len("clade:"):])
+    return int(text), None
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+import json
+import random
+import re
+import string
+import threading
+import time
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+from lxml import etree
+
+import metrics
+from scheduler import TokenBucket
+
+# base url of the E-utilities, point it to a local server to run offline
+eutils_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+email = None
+api_key = None
+tool = "Bioinfo_genome"
+
+# number of accessions asked in a single efetch, and in a single esummary
+batch_size = 100
+summary_batch_size = 500
+# larger batches are posted to the history server before the efetch
+max_post_ids = 500
+timeout = 120
+
+_parser = etree.XMLParser(huge_tree = True)
+
+# GBSeq elements are copied to the cache as raw bytes read chunk_size at a time
+chunk_size = 1024 * 1024
+_GBSEQ_START = b"<GBSeq>"
+_GBSEQ_END = b"</GBSeq>"
+# the accessions are looked for in the first bytes of a GBSeq, before its features and sequence
+_HEAD_SIZE = 64 * 1024
+_PRIMARY_ACCESSION = re.compile(rb"<GBSeq_primary-accession>([^<]*)</GBSeq_primary-accession>")
+_ACCESSION_VERSION = re.compile(rb"<GBSeq_accession-version>([^<]*)</GBSeq_accession-version>")
+_ERROR = re.compile(rb"<ERROR>([^<]*)</ERROR>")
+
+# NCBI allows 3 requests per second, 10 with an API key
+rate_limiter = TokenBucket(3)
+
+# size of the records downloaded since the start
+bytes_received = 0
+_bytes_lock = threading.Lock()
+
+class EntrezError(IOError):
+    """
+    error message returned by the E-utilities
+    """
+    pass
+
+class GBRecord:
+    """
+    sequence and feature table of a GBSeq record
+    """
+    def __init__(self, accession, version, sequence, features):
+        self.accession = accession
+        self.version = version
+        self.sequence = sequence
+        # list of (GBFeature_key, GBFeature_location)
+        self.features = features
+
+def set_api_key(key):
+    """
+    use an NCBI API key, raising the request rate limit
+    """
+    global api_key
+    api_key = key
+    rate_limiter.rate = 10 if key is not None else 3
+
+def random_email():
+    """
+    return a random email address, NCBI asks for one with each request
+    """
+    return ''.join(random.choice(string.ascii_lowercase) for i in range(20))+'@'+''.join(random.choice(string.ascii_lowercase) for i in range(20))+ '.com'
+
+def request(cgi, params, stream = False):
+    """
+    POST params to an E-utility and return the raw payload,
+    or the open response if stream is True
+    """
+    params = dict(params)
+    params["tool"] = tool
+    params["email"] = email if email is not None else random_email()
+    if api_key is not None:
+        params["api_key"] = api_key
+    rate_limiter.acquire()
+    with metrics.recorder.timer("network_wait"):
+        response = urlopen(eutils_url + cgi, data = urlencode(params).encode(), timeout = timeout)
+    if stream:
+        return response
+    with response:
+        return response.read()
+
+def _check_error(root):
+    error = root.find(".//ERROR")
+    if root.tag == "ERROR" or error is not None:
+        raise EntrezError((root if root.tag == "ERROR" else error).text)
+
+def epost(ids, db = "nucleotide"):
+    """
+    upload ids to the history server
+    return (WebEnv, query_key)
+    """
+    root = etree.fromstring(request("epost.fcgi", {"db": db, "id": ",".join(ids)}), _parser)
+    _check_error(root)
+    return root.findtext("WebEnv"), root.findtext("QueryKey")
+
+def efetch(ids, db = "nucleotide", use_history = True, stream = False, rettype = "gbwithparts"):
+    """
+    fetch the GBSet XML of a batch of ids in one request, through the
+    history server if use_history and there are more than max_post_ids.
+    rettype gbwithparts makes NCBI expand the sequence of CON records,
+    use "gp" for the protein database
+    """
+    params = {"db": db, "rettype": rettype, "retmode": "xml"}
+    if use_history and len(ids) > max_post_ids:
+        (webenv, query_key) = epost(ids, db)
+        params.update({"WebEnv": webenv, "query_key": query_key, "retstart": 0, "retmax": len(ids)})
+    else:
+        params["id"] = ",".join(ids)
+    return request("efetch.fcgi", params, stream)
+
+def esummary(ids, db = "nucleotide"):
+    """
+    resolve the current version of ids, summary_batch_size accessions per request
+    return {id: (accession.version, update date 'YYYY/MM/DD')}, ids unknown to NCBI are left out
+    """
+    ids = list(dict.fromkeys(ids))
+    summaries = {}
+    for start in range(0, len(ids), summary_batch_size):
+        batch = ids[start:start + summary_batch_size]
+        wanted = {id.split('.')[0]: id for id in batch}
+        answer = json.loads(request("esummary.fcgi", {"db": db, "id": ",".join(batch), "retmode": "json", "version": "2.0"}))
+        if "error" in answer:
+            raise EntrezError(answer["error"])
+        result = answer.get("result", {})
+        for uid in result.get("uids", []):
+            summary = result[uid]
+            version = summary.get("accessionversion")
+            if "error" in summary or not version:
+                continue
+            id = wanted.get(version.split('.')[0])
+            if id is not None:
+                summaries[id] = (version, summary.get("updatedate", ""))
+    return summaries
+
+def _release(elem):
+    # free an element already handled and the siblings handled before it
+    elem.clear(keep_tail = True)
+    while elem.getprevious() is not None:
+        del elem.getparent()[0]
+
+def iter_gbseq(source):
+    """
+    stream the GBSeq elements of a GBSet, each one is released once the
+    consumer moves to the next
+    """
+    for (event, elem) in etree.iterparse(source, events = ("end",), tag = ("GBSeq", "ERROR"), huge_tree = True):
+        if elem.tag == "ERROR":
+            raise EntrezError(elem.text)
+        yield elem
+        _release(elem)
+
+def _check_raw_error(outside):
+    error = _ERROR.search(outside)
+    if error is not None:
+        raise EntrezError(error.group(1).decode(errors = "replace"))
+
+def iter_raw_gbseq(source):
+    """
+    split a GBSet answer into the raw bytes of its GBSeq elements without
+    parsing them, so a record is never held whole in memory.
+    yield ("start", b''), then ("data", bytes) chunks, then ("end", b'') for every GBSeq
+    """
+    buffer = b''
+    # end of the bytes between the records, where an ERROR would be
+    outside = b''
+    inside = False
+    while True:
+        chunk = source.read(chunk_size)
+        buffer += chunk
+        while True:
+            if not inside:
+                start = buffer.find(_GBSEQ_START)
+                if start < 0:
+                    # keep what may be the beginning of a start tag
+                    cut = max(len(buffer) - len(_GBSEQ_START) + 1, 0)
+                    outside = (outside + buffer[:cut])[-_HEAD_SIZE:]
+                    buffer = buffer[cut:]
+                    break
+                _check_raw_error(outside + buffer[:start])
+                outside = b''
+                buffer = buffer[start:]
+                inside = True
+                yield "start", b''
+            else:
+                end = buffer.find(_GBSEQ_END)
+                if end < 0:
+                    cut = max(len(buffer) - len(_GBSEQ_END) + 1, 0)
+                    if cut != 0:
+                        yield "data", buffer[:cut]
+                    buffer = buffer[cut:]
+                    break
+                end += len(_GBSEQ_END)
+                yield "data", buffer[:end]
+                yield "end", b''
+                buffer = buffer[end:]
+                inside = False
+        if len(chunk) == 0:
+            break
+    if inside:
+        raise EntrezError("answer truncated inside a GBSeq")
+    _check_raw_error(outside + buffer)
+
+def iter_records(source, keys = None):
+    """
+    stream the GBRecord objects of a GBSet or GBSeq document. Only the
+    features whose GBFeature_key is in keys (all if None) are kept, every
+    other element is released as soon as it is parsed
+    """
+    accession = version = None
+    sequence = ''
+    features = []
+    for (event, elem) in etree.iterparse(source, events = ("end",), huge_tree = True):
+        tag = elem.tag
+        if tag == "GBFeature":
+            key = elem.findtext("GBFeature_key")
+            if keys is None or key in keys:
+                features.append((key, elem.findtext("GBFeature_location")))
+            _release(elem)
+        elif tag == "GBSeq":
+            yield GBRecord(accession, version, sequence, features)
+            accession = version = None
+            sequence = ''
+            features = []
+            _release(elem)
+        elif tag == "ERROR":
+            raise EntrezError(elem.text)
+        elif elem.getparent() is not None and elem.getparent().tag == "GBSeq":
+            if tag == "GBSeq_primary-accession":
+                accession = elem.text
+            elif tag == "GBSeq_accession-version":
+                version = elem.text
+            elif tag == "GBSeq_sequence":
+                sequence = (elem.text or '').upper()
+            elem.clear(keep_tail = True)
+
+def fetch_records(ids, db = "nucleotide", use_history = True, cache = None, keys = None, download = True):
+    """
+    yield (id, GBRecord) for every id, keeping only the features whose key
+    is in keys. With a cache, missing records are first downloaded into it
+    and every record is then streamed back from disk (download False only
+    reads the records already cached), otherwise records are streamed from
+    the network batch_size accessions per request.
+    ids missing from the answer, or from the cache in offline mode, are skipped
+    """
+    ids = list(ids)
+    if cache is None:
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            wanted = {}
+            for id in batch:
+                wanted[id] = id
+                wanted[id.split('.')[0]] = id
+            with efetch(batch, db, use_history, stream = True) as response:
+                for record in iter_records(response, keys):
+                    id = wanted.get(record.version, wanted.get(record.accession))
+                    if id is not None:
+                        yield id, record
+        return
+    if download:
+        download_records(ids, db, use_history, cache)
+    for id in ids:
+        source = cache.open(id)
+        if source is None:
+            print("Not in record cache : " + id)
+            continue
+        with source:
+            for record in iter_records(source, keys):
+                yield id, record
+
+def download_records(ids, db = "nucleotide", use_history = True, cache = None, stale = ()):
+    """
+    store in cache the records of ids it does not hold yet, and those of stale
+    return the number of records downloaded
+    """
+    ids = list(dict.fromkeys(ids))
+    missing = [id for id in ids if id in stale or cache.version_of(id) is None]
+    # counted before the records are read back from the cache
+    cache.count(len(ids) - len(missing), len(missing))
+    if cache.offline:
+        return 0
+    return store_records(missing, db, use_history, cache)
+
+def store_records(ids, db = "nucleotide", use_history = True, cache = None):
+    """
+    download the records of ids into cache, batch_size accessions per request
+    return the number of records downloaded
+    """
+    global bytes_received
+    nb_downloaded = 0
+    for start in range(0, len(ids), batch_size):
+        with efetch(ids[start:start + batch_size], db, use_history, stream = True) as response:
+            # time to receive and store each record, the answer streams in while it is split
+            last = time.perf_counter()
+            writer = None
+            try:
+                for (event, data) in iter_raw_gbseq(response):
+                    if event == "start":
+                        writer = cache.writer()
+                        head = b''
+                    elif event == "data":
+                        writer.write(data)
+                        if len(head) < _HEAD_SIZE:
+                            head += data[:_HEAD_SIZE - len(head)]
+                    else:
+                        version = _ACCESSION_VERSION.search(head)
+                        accession = _PRIMARY_ACCESSION.search(head)
+                        if version is None or accession is None:
+                            raise EntrezError("GBSeq without accession")
+                        version = version.group(1).decode()
+                        writer.commit(version, accession.group(1).decode())
+                        size = writer.size
+                        writer = None
+                        nb_downloaded += 1
+                        with _bytes_lock:
+                            bytes_received += size
+                        now = time.perf_counter()
+                        metrics.recorder.add_time("download", now - last, version)
+                        metrics.recorder.count("bytes_received", size, version)
+                        last = now
+            finally:
+                if writer is not None:
+                    writer.abort()
+    return nb_downloaded
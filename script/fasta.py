@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import os
+
+LINE_WIDTH = 70
+BUFFER_SIZE = 1024 * 1024
+
+class FastaWriter:
+    """
+    buffered FASTA writer. Sequences are wrapped at line_width and written
+    to a temporary file, renamed over filename by close() together with a
+    samtools-style .fai index (name, length, offset, line bases, line width)
+    """
+    def __init__(self, filename, line_width = LINE_WIDTH):
+        self.filename = filename
+        self.line_width = line_width
+        self.tmp = filename + ".tmp"
+        self.out = open(self.tmp, 'wb', buffering = BUFFER_SIZE)
+        self.index = []
+        self.nb_records = 0
+
+    def write(self, name, sequence, description = ''):
+        """
+        append a record, name must be unique and contain no space
+        """
+        header = ">" + name + (" " + description if description else "") + "\n"
+        self.out.write(header.encode())
+        offset = self.out.tell()
+        width = self.line_width
+        self.out.write(b'\n'.join(sequence[i:i + width] for i in range(0, len(sequence), width)))
+        if len(sequence) != 0:
+            self.out.write(b'\n')
+        self.index.append((name, len(sequence), offset, width, width + 1))
+        self.nb_records += 1
+
+    def close(self):
+        """
+        publish the file and its index
+        """
+        self.out.close()
+        with open(self.tmp + ".fai", 'w') as fai:
+            for entry in self.index:
+                fai.write('\t'.join(str(field) for field in entry) + "\n")
+        os.replace(self.tmp + ".fai", self.filename + ".fai")
+        os.replace(self.tmp, self.filename)
+
+    def abort(self):
+        """
+        drop the file being written
+        """
+        self.out.close()
+        for tmp in (self.tmp, self.tmp + ".fai"):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def read_index(filename):
+    """
+    return {name: (length, offset, line bases, line width)} from the .fai of filename
+    """
+    index = {}
+    with open(filename + ".fai") as fai:
+        for row in fai:
+            (name, length, offset, line_bases, line_width) = row.rstrip('\n').split('\t')[:5]
+            index[name] = (int(length), int(offset), int(line_bases), int(line_width))
+    return index
+
+def read_region(filename, name, index = None):
+    """
+    return the sequence of record name, reading only its own lines
+    """
+    if index is None:
+        index = read_index(filename)
+    (length, offset, line_bases, line_width) = index[name]
+    if length == 0:
+        return b''
+    nb_lines = (length - 1) // line_bases
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        return f.read(length + nb_lines * (line_width - line_bases)).replace(b'\n', b'')
@@ -1,301 +1,566 @@
 #!/usr/bin/env python3
-from Bio import Entrez
-from lxml import etree
 import pandas as pd
 import os
 import shutil
-from Bio import SeqIO
 import pickle
-from Bio.SeqFeature import SeqFeature, FeatureLocation, CompoundLocation
-import random
-import string
+import hashlib
+import json
+import threading
+import time
+import entrez
+import metrics
+import pipeline
+import reports
+from location import extract_regions
+from fasta import FastaWriter
+from packed import PackedWriter
+from cache import RecordCache
+from scheduler import Scheduler
+from store import OrganismStore, SCHEMA_VERSION, VERSIONS_SUFFIX, sanitize_name, organism_dir
 
 save_pickle = False
 debug = False
 
-def reset_tree(progress = None, window = None):
+PICKLE_PATH = "../pickle/organism_df"
+
+# downloaded GenBank records, see get_record_cache
+record_cache = None
+_record_cache_lock = threading.Lock()
+# size cap of the record cache in bytes and offline mode
+cache_max_size = 2 * 1024 ** 3
+offline = False
+
+# regions are written as indexed FASTA ("fasta") or 2-bit packed ("packed") files
+output_format = "fasta"
+# extension and side files of each format
+OUTPUT_FORMATS = {"fasta": (".fasta", [".fai"], FastaWriter), "packed": (".pack", [], PackedWriter)}
+
+# worker processes parsing and extracting records in fetch_organisms, 1 runs them in the calling thread
+extract_processes = os.cpu_count() or 1
+
+# refresh mode of fetch_organisms: the current versions of the records are
+# resolved with esummary, only the records that changed are downloaded and
+# only the organisms having one are extracted again
+check_versions = False
+
+REPORTS_PATH = "../GENOME_REPORTS/"
+# retired organisms keep their downloads here after a refresh
+RETIRED_PATH = "../Results_retired/"
+
+def report_files():
     """
-    reset the tree stored locally
-    return organism_df
+    return the genome report files the organism index is built from
+    """
+    return [REPORTS_PATH + 'overview.txt'] + sorted(REPORTS_PATH + 'IDS/' + ids for ids in os.listdir(REPORTS_PATH + 'IDS/'))
+
+def reports_fingerprint():
+    """
+    return a JSON string identifying the content of the genome report files
+    """
+    fingerprint = {}
+    for filename in report_files():
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        fingerprint[os.path.basename(filename)] = digest.hexdigest()
+    return json.dumps(fingerprint, sort_keys = True)
+
+def parse_reports(progress = None):
     """
-    if (progress != None and window != None):
-        progress['value'] = 0
-        window.update_idletasks()
+    parse overview.txt and the IDS files, progress is called with the percentage done
+    return (names, paths, NC lists) of the organisms having NC accessions
+    """
+    overview = reports.load_overview(REPORTS_PATH + 'overview.txt')
+    if progress != None:
+        progress(25)
+    ids = reports.load_ids(REPORTS_PATH + 'IDS/')
+    if progress != None:
+        progress(75)
+    if debug:
+        print(str(len(overview)) + " organisms in overview.txt, " + str(len(ids)) + " NC accessions")
+    return reports.organism_index(overview, ids)
+
+def save_index(names, paths, NC_lists, fingerprint):
+    """
+    write the organism index and the fingerprint of the reports it comes from
+    return the OrganismStore
+    """
+    store = OrganismStore()
+    store.write(names, paths, NC_lists)
+    store.set_meta("reports_fingerprint", fingerprint)
+    # the former pickle file is only kept up to date on request
+    if save_pickle:
+        organism_df = pd.DataFrame({
+                    "name":names,
+                    "path":paths,
+                    "NC":NC_lists})
+        with open(PICKLE_PATH, 'wb') as f:
+            pickle.dump(organism_df, f)
+    return store
+
+def reset_tree(progress = None):
+    """
+    reset the tree stored locally, progress is called with the percentage done
+    return the OrganismStore
+    """
+    if progress != None:
+        progress(0)
     # delete previous tree
     if os.path.exists('../Results'):
         shutil.rmtree('../Results')
+    fingerprint = reports_fingerprint()
+    (names, paths, NC_lists) = parse_reports(progress)
+    for (name, path) in zip(names, paths):
+        directory = organism_dir(name, path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+    return save_index(names, paths, NC_lists, fingerprint)
 
-    # parse overview.txt
-    organism_names = []
-    organism_paths = []
-    with open('../GENOME_REPORTS/overview.txt') as f:
-        first_row = True
-        count_rows = 1
-        for row in f:
-            if debug:
-                print(count_rows, " / 59674")
-
-            if (progress != None and window != None and count_rows % 500 == 0):
-                progress['value'] = (count_rows/59674)*50
-                window.update_idletasks()
-            count_rows += 1
-            if first_row:
-                first_row=False
-                continue
-            parsed_row = row.split('\t')
-            organism = parsed_row[0].replace(' ','_').replace('/','_')
-            kingdom = parsed_row[1].replace(' ','_').replace('/','_')
-            group = parsed_row[2].replace(' ','_').replace('/','_')
-            subgroup = parsed_row[3].replace(' ','_').replace('/','_')
-            path = '../Results/' + kingdom +'/' + group +'/' + subgroup +'/' + organism
-            organism_names.append(parsed_row[0])
-            organism_paths.append('../Results/' + kingdom +'/' + group +'/' + subgroup +'/')
-
-    # parse ids files
-    ids_files = os.listdir('../GENOME_REPORTS/IDS/')
-
-    organism_names_ids = []
-    organism_paths_ids = []
-    organism_NC_ids = []
-
-    i = 0
-    for ids in ids_files:
-        i += 1
-        if (progress != None and window != None):
-                progress['value'] = 50 + (i/10)*50
-                window.update_idletasks()
-        if debug:
-            print(str(i) + ' ' * (1 if i >= 10 else 2) + '/ ' + str(len(ids_files)) + ' : ' + ids)
-        with open('../GENOME_REPORTS/IDS/' + ids) as f:
-            for row in f:
-                parsed_row = row.replace('\n', '').split('\t')
-                if (parsed_row[1][0:2] != 'NC'):
-                    continue
-                try:
-                    index = organism_names.index(parsed_row[5])
-                except ValueError:
-                    continue
-                try:
-                    organism_NC_ids[organism_names_ids.index(organism_names[index])].append(parsed_row[1])
-                except ValueError:
-                    organism_names_ids.append(organism_names[index])
-                    organism_paths_ids.append(organism_paths[index])
-                    organism_NC_ids.append([parsed_row[1]])
-                    name = organism_names[index].replace(" ", "_")
-                    name = name.replace("[", "_")
-                    name = name.replace("]", "_")
-                    name = name.replace(":", "_")
-                    path = organism_paths[index] + name + "/"
-                    if not os.path.exists(path):
-                        os.makedirs(path)
-    organism_df = pd.DataFrame({
-                "name":organism_names_ids,
-                "path":organism_paths_ids,
-                "NC":organism_NC_ids})
-    # create pickle file saving the dataframe
-    if not os.path.exists("../pickle"):
-        os.makedirs("../pickle")
-    with open("../pickle/organism_df", 'wb') as f:
-        pickle.dump(organism_df, f)
-    return organism_df
+def _retired_dir(directory):
+    return RETIRED_PATH + directory[len('../Results/'):]
 
-def load_df_from_pickle():
+def _retire(directory):
+    # keep the downloads of an organism no longer in the reports, merged
+    # into those kept if it was already retired once
+    if not os.path.isdir(directory):
+        return
+    if len(os.listdir(directory)) == 0:
+        os.rmdir(directory)
+        return
+    retired = _retired_dir(directory)
+    if not os.path.isdir(retired):
+        os.renames(directory.rstrip('/'), retired.rstrip('/'))
+        return
+    for entry in os.listdir(directory):
+        os.replace(directory + entry, retired + entry)
+    os.rmdir(directory)
+
+def _restore(directory):
     """
-    load pickle dataframe and return it
+    move back the retired downloads of an organism added again to the reports
+    return True if there were some
     """
-    try:
-        with open("../pickle/organism_df", 'rb') as f:
-            organism_df = pickle.load(f)
-    except IOError:
-        print("Pickle file not accessible")
-        return reset_tree()
+    retired = _retired_dir(directory)
+    if not os.path.isdir(retired):
+        return False
+    if os.path.isdir(directory):
+        if len(os.listdir(directory)) != 0:
+            return False
+        os.rmdir(directory)
+    os.renames(retired.rstrip('/'), directory.rstrip('/'))
+    return True
+
+def refresh_tree(progress = None):
+    """
+    update the tree stored locally to new genome reports, keeping the
+    downloads: only the directories of added, moved and removed organisms
+    are touched. Nothing is done if the reports did not change. A directory
+    that cannot be moved is reported, the index is written anyway.
+    return (OrganismStore, summary dict of the changes)
+    """
+    store = OrganismStore()
+    fingerprint = reports_fingerprint()
+    summary = {"added": [], "removed": [], "moved": [], "changed": [], "restored": [], "failed": []}
+    if store.version == SCHEMA_VERSION and store.get_meta("reports_fingerprint") == fingerprint:
+        if progress != None:
+            progress(100)
+        return store, summary
+    old = {name: (path, NC_list) for (index, name, path, NC_list) in store.organisms()}
+    (names, paths, NC_lists) = parse_reports(progress)
+    for (name, path, NC_list) in zip(names, paths, NC_lists):
+        if name not in old:
+            summary["added"].append(name)
+            directory = organism_dir(name, path)
+            try:
+                if _restore(directory):
+                    summary["restored"].append(name)
+                elif not os.path.exists(directory):
+                    os.makedirs(directory)
+            except OSError as error:
+                print("Directory of [" + name + "] not created : " + str(error))
+                summary["failed"].append(name)
+            continue
+        (old_path, old_NC_list) = old.pop(name)
+        if old_path != path:
+            summary["moved"].append(name)
+            old_directory = organism_dir(name, old_path)
+            directory = organism_dir(name, path)
+            try:
+                if os.path.isdir(old_directory) and not os.path.exists(directory):
+                    os.renames(old_directory.rstrip('/'), directory.rstrip('/'))
+                elif not os.path.exists(directory):
+                    os.makedirs(directory)
+            except OSError as error:
+                print("Directory of [" + name + "] not moved : " + str(error))
+                summary["failed"].append(name)
+        if old_NC_list != NC_list:
+            summary["changed"].append(name)
+    # organisms left in old are gone from the reports
+    new_directories = set(organism_dir(name, path) for (name, path) in zip(names, paths))
+    for (name, (path, NC_list)) in old.items():
+        summary["removed"].append(name)
+        if organism_dir(name, path) not in new_directories:
+            try:
+                _retire(organism_dir(name, path))
+            except OSError as error:
+                print("Downloads of [" + name + "] not retired : " + str(error))
+                summary["failed"].append(name)
+    store.close()
+    return save_index(names, paths, NC_lists, fingerprint), summary
+
+def load_store():
+    """
+    open the organism index, migrating the former pickle file if needed
+    return an OrganismStore
+    """
+    store = OrganismStore()
+    if store.version != SCHEMA_VERSION:
+        try:
+            with open(PICKLE_PATH, 'rb') as f:
+                organism_df = pickle.load(f)
+        except IOError:
+            print("Organism index and pickle file not accessible")
+            store.close()
+            return reset_tree()
+        print("Migrating " + PICKLE_PATH + " to " + store.filename)
+        store.write(list(organism_df["name"]), list(organism_df["path"]), list(organism_df["NC"]))
     if not os.path.exists('../Results'):
-        for i in range(len(organism_df)):
-            name = organism_df["name"][i].replace(" ", "_")
-            name = name.replace("[", "_")
-            name = name.replace("]", "_")
-            name = name.replace(":", "_")
-            path = organism_df["path"][i] + name + "/"
+        for (index, name, path, NC_list) in store.organisms():
+            path = path + sanitize_name(name) + "/"
             if not os.path.exists(path):
                 os.makedirs(path)
-    return organism_df
+    return store
 
-def load_data_from_NC(index, name, path, NC_list, selected_region):
+def load_df_from_pickle():
     """
-    download data of an organism from genbank using the API
+    load the organism index and return it as a dataframe
     """
-    letters = string.ascii_lowercase
-    Entrez.email = ''.join(random.choice(string.ascii_lowercase) for i in range(20))+'@'+''.join(random.choice(string.ascii_lowercase) for i in range(20))+ '.com'
-    NC_i = 1
-    nb_region_found = 0
-    print()
-    print("downloading [" + name + "]")
+    return load_store().to_dataframe()
+
+def get_record_cache():
+    """
+    open the record cache on first use and apply the current settings,
+    the download threads share a single cache
+    """
+    global record_cache
+    with _record_cache_lock:
+        if record_cache is None:
+            record_cache = RecordCache(max_size = cache_max_size, offline = offline)
+        record_cache.max_size = cache_max_size
+        record_cache.offline = offline
+        return record_cache
+
+def _day(timestamp):
+    # same format as the esummary update dates, compared as strings
+    return time.strftime('%Y/%m/%d', time.localtime(timestamp))
+
+def versions_filename(name, path):
+    name = sanitize_name(name)
+    return path + name + "/" + name + VERSIONS_SUFFIX
+
+def read_versions(name, path):
+    """
+    return the versions recorded for an organism: {"records": {accession: version},
+    "format": output format, "regions": {key: [nb regions, extraction time]}}, None if there are none
+    """
+    try:
+        with open(versions_filename(name, path)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def _write_versions(name, path, records, regions):
+    """
+    record the versions of records (accession -> version) the regions
+    ({key: nb regions}) of an organism were extracted from
+    """
+    now = time.time()
+    previous = read_versions(name, path)
+    extracted = {key: [nb_regions, now] for (key, nb_regions) in regions.items()}
+    if previous is not None and previous["records"] == records and previous["format"] == output_format:
+        # regions of other keys extracted from the same records are still current
+        extracted = dict(previous["regions"], **extracted)
+    filename = versions_filename(name, path)
+    os.makedirs(os.path.dirname(filename), exist_ok = True)
+    with open(filename + ".tmp", 'w') as f:
+        json.dump({"records": records, "format": output_format, "regions": extracted}, f, sort_keys = True)
+    os.replace(filename + ".tmp", filename)
+
+def up_to_date(name, path, NC_list, keys, summaries):
+    """
+    return the number of regions of keys extracted for an organism if none
+    of its records changed since, according to summaries (see entrez.esummary),
+    None if it must be extracted again
+    """
+    state = read_versions(name, path)
+    if state is None or state["format"] != output_format:
+        return None
+    if set(state["records"]) != {NC.split('.')[0] for NC in NC_list}:
+        return None
     for NC in NC_list:
-        print("NC : " + str(NC_i) + " / " + str(len(NC_list)))
-        name = name.replace(" ", "_")
-        name = name.replace("[", "_")
-        name = name.replace("]", "_")
-        name = name.replace(":", "_")
-        NC_i += 1
+        if NC not in summaries or state["records"][NC.split('.')[0]] != summaries[NC][0]:
+            return None
+    nb_region_found = 0
+    for key in keys:
+        if key not in state["regions"]:
+            return None
+        (nb_regions, extracted) = state["regions"][key]
+        # same version updated after the extraction
+        if any(summaries[NC][1] > _day(extracted) for NC in NC_list):
+            return None
+        if nb_regions != 0 and not os.path.isfile(region_filename(name, path, key)):
+            return None
+        nb_region_found += nb_regions
+    return nb_region_found
+
+def changed_organisms(organisms, keys, scheduler):
+    """
+    resolve the current versions of the records of organisms in batched
+    esummary requests run on scheduler, the organisms of a batch that
+    failed are extracted again
+    return (up to date (name, nb_region_found), changed organisms with
+    versioned NC_list, cached records updated upstream since their download)
+    """
+    ids = list(dict.fromkeys(NC for (index, name, path, NC_list) in organisms for NC in NC_list))
+    batches = [ids[start:start + entrez.summary_batch_size] for start in range(0, len(ids), entrez.summary_batch_size)]
+    summaries = {}
+    for (batch, result, error) in scheduler.map((batch, entrez.esummary, (batch,), batch) for batch in batches):
+        if error is not None:
+            print("Version check failed for " + str(len(batch)) + " records : " + str(error))
+            continue
+        summaries.update(result)
+    cache = get_record_cache()
+    current = []
+    changed = []
+    for (index, name, path, NC_list) in organisms:
+        nb_region_found = up_to_date(name, path, NC_list, keys, summaries)
+        if nb_region_found is not None:
+            current.append((name, nb_region_found))
+        else:
+            changed.append((index, name, path, [summaries[NC][0] if NC in summaries else NC for NC in NC_list]))
+    stale = set()
+    for (version, updated) in summaries.values():
+        fetched = cache.fetched(version)
+        if fetched is not None and updated > _day(fetched):
+            stale.add(version)
+    print(str(len(summaries)) + " records checked, " + str(len(changed)) + " organisms changed, "
+          + str(len(stale)) + " cached records updated")
+    return current, changed, stale
+
+def download_organisms(organisms, scheduler, cancel = None, stale = ()):
+    """
+    download the records of organisms missing from the record cache, and
+    those of stale, on the threads of scheduler. The accessions of
+    consecutive organisms share the same efetch, entrez.batch_size per request.
+    yield ((index, name, path, NC_list), nb_downloaded, error) like
+    Scheduler.map as soon as the records of an organism are cached, error
+    is that of a failed request holding one of its accessions
+    """
+    cache = get_record_cache()
+    # [organism, batches it waits for, nb of its records downloaded], in order
+    waiting = []
+    # accession -> number of the batch downloading it
+    batch_of = {}
+    failed = {}
+    def jobs():
+        number = 0
+        batch = []
+        for (index, name, path, NC_list) in organisms:
+            if cancel is not None and cancel.is_set():
+                break
+            # an accession listed by several IDS files is read once
+            NC_list = list(dict.fromkeys(NC_list))
+            missing = [NC for NC in NC_list if NC in stale or cache.version_of(NC) is None]
+            # counted before the records are read back from the cache
+            cache.count(len(NC_list) - len(missing), len(missing))
+            batches = set()
+            if not cache.offline:
+                for NC in missing:
+                    if NC not in batch_of:
+                        batch_of[NC] = number
+                        batch.append(NC)
+                        if len(batch) == entrez.batch_size:
+                            yield (batch, entrez.store_records, (batch, "nucleotide", True, cache), number)
+                            number += 1
+                            batch = []
+                    batches.add(batch_of[NC])
+            waiting.append([(index, name, path, NC_list), batches, len(missing)])
+        if len(batch) != 0:
+            yield (batch, entrez.store_records, (batch, "nucleotide", True, cache), number)
+    def ready():
+        for item in [item for item in waiting if len(item[1]) == 0 or not item[1].isdisjoint(failed)]:
+            waiting.remove(item)
+            (organism, batches, nb_downloaded) = item
+            errors = [failed[number] for number in batches if number in failed]
+            if len(errors) != 0:
+                yield organism, None, errors[0]
+            else:
+                yield organism, nb_downloaded, None
+    for (number, nb_downloaded, error) in scheduler.map(jobs()):
+        if error is not None:
+            failed[number] = error
+        else:
+            for (organism, batches, nb) in waiting:
+                batches.discard(number)
+        yield from ready()
+    yield from ready()
+
+def fetch_organisms(organisms, selected_region, scheduler = None, cancel = None, on_downloaded = None, processes = None):
+    """
+    download the records of several organisms concurrently, then extract
+    selected_region of each organism as soon as its records are cached.
+    organisms is an iterable of (index, name, path, NC_list), no new organism
+    is started once the threading.Event cancel is set. on_downloaded(name,
+    NC_list) is called once the records of an organism are cached.
+    With more than one process (extract_processes by default) records are
+    parsed and extracted on a process pool while the next downloads run,
+    the regions are written by the calling thread.
+    With check_versions, the organisms whose records did not change since
+    their extraction are not downloaded again
+    yield (name, nb_region_found), nb_region_found is None if the download failed
+    """
+    if scheduler is None:
+        scheduler = Scheduler()
+    if processes is None:
+        processes = extract_processes
+    keys = {selected_region} if isinstance(selected_region, str) else set(selected_region)
+    # opened before the download threads start
+    get_record_cache()
+    stale = set()
+    if check_versions and not offline:
+        (current, organisms, stale) = changed_organisms(list(organisms), keys, scheduler)
+        for (name, nb_region_found) in current:
+            print(name + " up to date")
+            yield name, nb_region_found
+    downloads = download_organisms(organisms, scheduler, cancel, stale)
+    if processes > 1:
+        write = lambda name, path, NC_list, records: _write_organism(name, path, NC_list, records, keys)
+        yield from pipeline.extract_in_pool(downloads, keys, get_record_cache(), write, processes, cancel, on_downloaded)
+        return
+    for ((index, name, path, NC_list), nb_downloaded, error) in downloads:
+        if cancel is not None and cancel.is_set():
+            continue
+        if error is not None:
+            print("Download failed for organism [" + name + "] : " + str(error))
+            yield name, None
+            continue
+        if on_downloaded is not None:
+            on_downloaded(name, NC_list)
+        # the records were just downloaded by the job
+        yield name, _write_organism(name, path, NC_list, _cached_regions(NC_list, keys, download = False), keys)
+
+def region_filename(name, path, key, format = None):
+    """
+    return the file holding the regions key of an organism, in output_format by default
+    """
+    name = sanitize_name(name)
+    return path + name + "/" + name + "_" + key + OUTPUT_FORMATS[format or output_format][0]
+
+def _remove_region_files(name, path, key, formats):
+    for format in formats:
+        filename = region_filename(name, path, key, format)
+        for filename in [filename] + [filename + side for side in OUTPUT_FORMATS[format][1]]:
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+def _cached_regions(NC_list, keys, download = True):
+    # parse each record from the cache, its regions are extracted as they are written
+    records = entrez.fetch_records(NC_list, cache = get_record_cache(), keys = keys, download = download)
+    while True:
+        start = time.perf_counter()
+        (NC, record) = next(records, (None, None))
+        if record is None:
+            return
         if debug:
             print("NC id  =", NC)
             print("----------------------------")
-        handle_fasta = Entrez.efetch(db="nucleotide", id=NC, rettype="fasta", retmode="text")
-        record_fasta = SeqIO.read(handle_fasta, "fasta")
-        if debug:
-            print(record_fasta)
-            print("----------------------------")
-        handle_fasta.close()
-        handle_text = Entrez.efetch(db="nucleotide", id=NC, retmode="xml")
-        record = Entrez.read(handle_text)
-        handle_text.close()
-        list_file = []
-        for i in range(len(record[0]["GBSeq_feature-table"])):
-            print("\tfeature : " + str(i + 1) + " / " + str(len(record[0]["GBSeq_feature-table"])))
-            feature_location = record[0]["GBSeq_feature-table"][i]["GBFeature_location"]
-            feature_key = record[0]["GBSeq_feature-table"][i]["GBFeature_key"]
-            if feature_key != selected_region:
+        timings = {"xml_parse": time.perf_counter() - start, "location_decode": 0.0, "extraction": 0.0}
+        yield record.version or NC, extract_regions(record.sequence.encode(), record.features, keys, timings), timings
+
+def write_regions(name, path, NC_list, keys, records):
+    """
+    write the regions of an organism to one file per key, records is an
+    iterable of (accession, regions, timings) in NC order, regions an
+    iterable of (key, location, region)
+    return the number of regions written, None if a record of NC_list
+    could not be read: the files of a previous run are then left as they were.
+    A record read twice is only written once
+    """
+    recorder = metrics.recorder
+    nb_region_found = 0
+    # one writer per key, files are only replaced once every NC is extracted
+    writers = {}
+    versions = {}
+    nb_per_key = {}
+    try:
+        for (accession, regions, timings) in records:
+            if accession is None or accession.split('.')[0] in versions:
                 continue
-            nb_region_found += 1
-            NC_filename = str(name) + "_" + feature_key + "_NC_" + str(NC_i) + ".txt"
-            if len(list_file) != 0 :
-                if NC_filename not in list_file:
-                    os.remove(path + name + "/" + NC_filename)
-                    list_file.append(NC_filename)
-            else :
-                if os.path.isfile(path + name + "/" + NC_filename):
-                    os.remove(path + name + "/" + NC_filename)
-                list_file.append(NC_filename)
-            with open(path + name + "/" + NC_filename, 'a+') as out:
-                if debug:
-                    print(i+1, "/", len(record[0]["GBSeq_feature-table"]))
-                    print(feature_location)
-                # TODO Tests sur les regions (partie 2.3)
-                out.write(feature_key + ' ' + feature_location + "\n")
-                if feature_location.find("complement")!= -1 and feature_location.find("join") != -1:
-                    feature_location = feature_location[16:-1]
-                    x = feature_location.split(",")
-                    fn = []
-                    is_valid = True
-                    for xi in x:
-                        xi = xi.split("..")
-                        try:
-                            (int(xi[0]),int(xi[1]))
-                        except ValueError:
-                            is_valid = False
-                        else:
-                            if(check_inf_sup(xi[0],xi[1]) == False):
-                                is_valid = False
-                            fn.append(FeatureLocation(int(xi[0]), int(xi[1])))
-                    if not is_valid:
-                        continue
-                    f = CompoundLocation(fn)
-                    if debug:
-                        print("COMPLEMENT JOIN")
-                        print(f.extract(record_fasta.seq).complement())
-                    out.write(str(f.extract(record_fasta.seq).complement()))
-
-                elif feature_location.find("complement")!= -1:
-                    feature_location = feature_location[11:-1]
-                    x = feature_location.split("..")
-                    try:
-                        (int(x[0]),int(x[1]))
-                    except ValueError:
-                        continue
-                    else:
-                        if(check_inf_sup(x[0],x[1]) == False):
-                            continue
-                        f = SeqFeature(FeatureLocation(int(x[0]), int(x[1])), type="domain")
-                        if debug:
-                            print("COMPLEMENT")
-                            print(f.extract(record_fasta.seq).complement())
-                        out.write(str(f.extract(record_fasta.seq).complement()))
-
-                elif feature_location.find("join") != -1:
-                    feature_location = feature_location[5:-1]
-                    x = feature_location.split(",")
-                    fn = []
-                    is_valid = True
-                    for xi in x:
-                        xi = xi.split("..")
-                        try:
-                            (int(xi[0]),int(xi[1]))
-                        except ValueError:
-                            is_valid = False
-                        else:
-                            if(check_inf_sup(xi[0],xi[1]) == False):
-                                is_valid = False
-                            fn.append(FeatureLocation(int(xi[0]), int(xi[1])))
-                    if not is_valid:
-                        continue
-                    f = CompoundLocation(fn)
-                    if debug:
-                        print("COMPLEMENT JOIN")
-                        print(f.extract(record_fasta.seq).complement())
-                    out.write(str(f.extract(record_fasta.seq).complement()))
-
-                elif feature_location.find("complement")!= -1:
-                    feature_location = feature_location[11:-1]
-                    x = feature_location.split("..")
-                    try:
-                        (int(x[0]),int(x[1]))
-                    except ValueError:
-                        continue
-                    else:
-                        if(check_inf_sup(x[0],x[1]) == False):
-                            continue
-                        f = SeqFeature(FeatureLocation(int(x[0]), int(x[1])), type="domain")
-                        if debug:
-                            print("COMPLEMENT")
-                            print(f.extract(record_fasta.seq).complement())
-                        out.write(str(f.extract(record_fasta.seq).complement()))
-
-                elif feature_location.find("join") != -1:
-                    feature_location = feature_location[5:-1]
-                    x = feature_location.split(",")
-                    fn = []
-                    is_valid = True
-                    for xi in x:
-                        xi = xi.split("..")
-                        try:
-                            (int(x[0]),int(x[1]))
-                        except ValueError:
-                            is_valid = False
-                        else:
-                            if(check_inf_sup(xi[0],xi[1]) == False):
-                                is_valid = False
-                            fn.append(FeatureLocation(int(xi[0]), int(xi[1])))
-                    if not is_valid:
-                        continue
-                    f = CompoundLocation(fn)
-                    if debug:
-                        print("JOIN")
-                        print(f.extract(record_fasta.seq))
-                    out.write(str(f.extract(record_fasta.seq)))
-
-                else:
-                    x = feature_location.split("..")
-                    try:
-                        (int(x[0]),int(x[1]))
-                    except ValueError:
-                        continue
-                    else:
-                        if(check_inf_sup(x[0],x[1]) == False):
-                            continue
-                        f = SeqFeature(FeatureLocation(int(x[0]), int(x[1])), type="domain")
-                        if debug:
-                            print("EXTRACT")
-                            print(f.extract(record_fasta.seq))
-                        out.write(str(f.extract(record_fasta.seq)))
-                out.write("\n")
+            recorder.label(accession, organism = name)
+            versions[accession.split('.')[0]] = accession
+            nb_found = {}
+            file_write = 0.0
+            for (feature_key, feature_location, region) in regions:
+                start = time.perf_counter()
+                if feature_key not in writers:
+                    writers[feature_key] = OUTPUT_FORMATS[output_format][2](region_filename(name, path, feature_key))
+                nb_found[feature_key] = nb_found.get(feature_key, 0) + 1
+                writers[feature_key].write(accession + "_" + feature_key + "_" + str(nb_found[feature_key]),
+                                           region, feature_key + " " + feature_location)
+                file_write += time.perf_counter() - start
+            nb_regions = sum(nb_found.values())
+            nb_region_found += nb_regions
+            for (key, nb) in nb_found.items():
+                nb_per_key[key] = nb_per_key.get(key, 0) + nb
+            timings["file_write"] = file_write
+            for (stage, seconds) in timings.items():
+                recorder.add_time(stage, seconds, accession, 1 if stage == "xml_parse" else nb_regions)
+            recorder.count("regions", nb_regions, accession)
+    except:
+        for writer in writers.values():
+            writer.abort()
+        raise
+    missing = {NC.split('.')[0] for NC in NC_list} - set(versions)
+    if len(missing) != 0:
+        for writer in writers.values():
+            writer.abort()
+        print("Records not read for organism [" + name + "] : " + ", ".join(sorted(missing)))
+        return None
+    start = time.perf_counter()
+    for writer in writers.values():
+        writer.close()
+    recorder.add_time("file_write", time.perf_counter() - start, calls = len(writers))
+    # regions not found this time must not keep the file of a previous run,
+    # nor the regions found the file of a previous run in another format
+    for key in keys:
+        if key in writers:
+            _remove_region_files(name, path, key, [format for format in OUTPUT_FORMATS if format != output_format])
+        else:
+            _remove_region_files(name, path, key, OUTPUT_FORMATS)
+    _write_versions(name, path, versions, {key: nb_per_key.get(key, 0) for key in keys})
+    return nb_region_found
+
+def _write_organism(name, path, NC_list, records, keys):
+    print()
+    print("downloading [" + name + "]")
+    nb_region_found = write_regions(name, path, NC_list, keys, records)
+    if nb_region_found is None:
+        return None
     if nb_region_found == 0:
         print("Selected functional region not found for organism : [" + name + "]")
         return 0
     print(name + " downloaded")
     return nb_region_found
 
-def check_inf_sup(inf,sup):
-    if(inf<=sup):
-        return True
-    else:
-        return False
+def load_data_from_NC(index, name, path, NC_list, selected_region):
+    """
+    download data of an organism from genbank using the API and extract the
+    regions of selected_region, a feature key or a collection of keys, to
+    one indexed FASTA or packed file per key, see output_format
+    return the number of regions found, None if a record could not be read
+    """
+    keys = {selected_region} if isinstance(selected_region, str) else set(selected_region)
+    NC_list = list(dict.fromkeys(NC_list))
+    # only the features of the selected regions are kept while parsing
+    return _write_organism(name, path, NC_list, _cached_regions(NC_list, keys), keys)
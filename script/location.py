@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+INSDC feature location parser and region extraction
+
+    467                          single base
+    340..565, <345..500, <1..>888 range, possibly partial
+    102^103                      site between two bases (no sequence)
+    complement(...)              opposite strand
+    join(...), order(...)        several segments
+    J00194.1:100..202            segment of another record (not extractable)
+"""
+import time
+
+# complement of the IUPAC nucleotide codes, S W and N are their own complement
+_COMPLEMENT = bytes.maketrans(b"ACGTUMRWSYKVHDBNacgtumrwsykvhdbn", b"TGCAAKYWSRMBDHVNtgcaakywsrmbdhvn")
+
+class LocationError(ValueError):
+    """
+    location that cannot be parsed or extracted
+    """
+    pass
+
+class Location:
+    """
+    parsed location: list of (start, end, strand) segments in transcription
+    order, start 0-based and end exclusive as in python slices
+    """
+    def __init__(self, parts, partial = False):
+        self.parts = parts
+        # '<' or '>' somewhere in the location
+        self.partial = partial
+
+    def __len__(self):
+        return sum(end - start for (start, end, strand) in self.parts)
+
+    def __repr__(self):
+        return "Location(" + repr(self.parts) + (", partial" if self.partial else "") + ")"
+
+class _Parser:
+    def __init__(self, text):
+        self.text = text.replace(' ', '').replace('\n', '')
+        self.pos = 0
+        self.partial = False
+
+    def error(self, message):
+        raise LocationError(message + " at " + str(self.pos) + " in '" + self.text + "'")
+
+    def peek(self):
+        return self.text[self.pos] if self.pos < len(self.text) else ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            self.error("expected '" + char + "'")
+        self.pos += 1
+
+    def number(self):
+        start = self.pos
+        while self.peek().isdigit():
+            self.pos += 1
+        if start == self.pos:
+            self.error("expected a position")
+        return int(self.text[start:self.pos])
+
+    def position(self):
+        if self.peek() in ('<', '>'):
+            self.partial = True
+            self.pos += 1
+        return self.number()
+
+    def location(self):
+        """
+        return the segments of the location starting at pos
+        """
+        if self.peek().isalpha():
+            start = self.pos
+            while self.peek().isalnum() or self.peek() in ('_', '.'):
+                self.pos += 1
+            word = self.text[start:self.pos]
+            if self.peek() == ':':
+                self.error("remote reference " + word)
+            if word == "complement":
+                self.expect('(')
+                parts = self.location()
+                self.expect(')')
+                return [(start, end, -strand) for (start, end, strand) in reversed(parts)]
+            if word in ("join", "order"):
+                self.expect('(')
+                parts = self.location()
+                while self.peek() == ',':
+                    self.pos += 1
+                    parts = parts + self.location()
+                self.expect(')')
+                return parts
+            self.error("unsupported operator " + word)
+        first = self.position()
+        char = self.peek()
+        if char == '^':
+            self.error("site between bases")
+        if char == '.':
+            self.pos += 1
+            if self.peek() != '.':
+                self.error("uncertain single base")
+            self.pos += 1
+            last = self.position()
+        else:
+            last = first
+        if first < 1 or first > last:
+            self.error("invalid range " + str(first) + ".." + str(last))
+        return [(first - 1, last, 1)]
+
+def parse_location(text):
+    """
+    parse a GBFeature_location string, raise LocationError if it cannot be extracted
+    """
+    parser = _Parser(text)
+    parts = parser.location()
+    if parser.pos != len(parser.text):
+        parser.error("unexpected character")
+    return Location(parts, parser.partial)
+
+def extract(sequence, location):
+    """
+    return the region of sequence (bytes) covered by location,
+    segments on the minus strand are reverse complemented
+    """
+    segments = []
+    for (start, end, strand) in location.parts:
+        if end > len(sequence):
+            raise LocationError("location " + str(end) + " beyond the sequence end " + str(len(sequence)))
+        if strand == 1:
+            segments.append(sequence[start:end])
+        else:
+            segments.append(sequence[start:end].translate(_COMPLEMENT)[::-1])
+    return b''.join(segments)
+
+def extract_regions(sequence, features, keys = None, timings = None):
+    """
+    extract in one pass every feature of features, a list of
+    (key, location), whose key is in keys (all if None) from sequence (bytes)
+    yield (key, location, region), features that cannot be extracted are skipped.
+    With a timings dict, the seconds spent parsing the locations and
+    extracting the regions are added to timings["location_decode"] and
+    timings["extraction"]
+    """
+    for (key, location) in features:
+        if keys is not None and key not in keys:
+            continue
+        try:
+            if timings is None:
+                region = extract(sequence, parse_location(location))
+            else:
+                start = time.perf_counter()
+                parsed = parse_location(location)
+                decoded = time.perf_counter()
+                region = extract(sequence, parsed)
+                timings["location_decode"] += decoded - start
+                timings["extraction"] += time.perf_counter() - decoded
+        except LocationError as error:
+            print("Skipped " + key + " " + location + " : " + str(error))
+            continue
+        yield key, location, region
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+retrieve the ribosomal protein markers listed in GENOME_REPORTS/MARKERS
+
+    python3 markers.py                    download every COG family
+    python3 markers.py --cog COG0048 --cog COG0049
+
+Each COG is written to ../Markers/<COG>.fasta with its .fai index, and
+../Markers/markers.db maps every GI to its COG, accession and organism.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+
+import entrez
+from fasta import FastaWriter, read_index, read_region
+from scheduler import Scheduler
+
+MARKERS_PATH = "../GENOME_REPORTS/MARKERS/"
+STORE_PATH = "../Markers/"
+# protein records are small, many of them fit in a single request
+BATCH_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS marker (
+    gi TEXT NOT NULL,
+    cog TEXT NOT NULL,
+    accession TEXT,
+    organism TEXT,
+    PRIMARY KEY (gi, cog)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS marker_cog ON marker(cog);
+CREATE INDEX IF NOT EXISTS marker_organism ON marker(organism);
+"""
+
+def load_markers(path = MARKERS_PATH):
+    """
+    return {COG: [GI, ...]} for every COG list of path
+    """
+    markers = {}
+    for filename in sorted(os.listdir(path)):
+        if not filename.startswith("COG"):
+            continue
+        with open(path + filename) as f:
+            markers[filename] = [row.strip() for row in f if row.strip()]
+    return markers
+
+def marker_cogs(markers):
+    """
+    return {GI: [COG, ...]}, each GI appearing once whatever the number of families listing it
+    """
+    cogs = {}
+    for (cog, gis) in markers.items():
+        for gi in gis:
+            cogs.setdefault(gi, []).append(cog)
+    return cogs
+
+def _gi_of(seq):
+    for seqid in seq.iterfind("GBSeq_other-seqids/GBSeqid"):
+        if seqid.text.startswith("gi|"):
+            return seqid.text[3:]
+    return None
+
+def fetch_proteins(gis):
+    """
+    download a batch of protein GIs
+    return a list of (GI, accession.version, organism, sequence)
+    """
+    proteins = []
+    with entrez.efetch(gis, "protein", stream = True, rettype = "gp") as response:
+        for seq in entrez.iter_gbseq(response):
+            proteins.append((_gi_of(seq), seq.findtext("GBSeq_accession-version"),
+                             seq.findtext("GBSeq_organism"), (seq.findtext("GBSeq_sequence") or '').upper()))
+    return proteins
+
+class MarkerStore:
+    """
+    per-COG indexed FASTA files and the GI / organism index
+    """
+    def __init__(self, path = STORE_PATH):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.connection = sqlite3.connect(path + "markers.db")
+        self.connection.executescript(_SCHEMA)
+        self.fasta_indexes = {}
+
+    def close(self):
+        self.connection.close()
+
+    def filename(self, cog):
+        return self.path + cog + ".fasta"
+
+    def build(self, markers, workers = 4, batch_size = BATCH_SIZE):
+        """
+        download every GI of markers in batches and write the COG files
+        return the GIs that could not be retrieved
+        """
+        cogs = marker_cogs(markers)
+        gis = list(cogs)
+        writers = {cog: FastaWriter(self.filename(cog)) for cog in markers}
+        rows = []
+        missing = set(gis)
+        batches = [gis[i:i + batch_size] for i in range(0, len(gis), batch_size)]
+        jobs = ((batch, fetch_proteins, (batch,), batch) for batch in batches)
+        try:
+            for (i, (batch, proteins, error)) in enumerate(Scheduler(workers = workers).map(jobs), 1):
+                if error is not None:
+                    print("Batch of " + str(len(batch)) + " GIs failed : " + str(error))
+                    continue
+                for (gi, accession, organism, sequence) in proteins:
+                    if gi not in cogs:
+                        continue
+                    missing.discard(gi)
+                    for cog in cogs[gi]:
+                        writers[cog].write(gi, sequence.encode(), (accession or '') + " [" + (organism or '') + "]")
+                        rows.append((gi, cog, accession, organism))
+                print("batch " + str(i) + " / " + str(len(batches)))
+        except:
+            for writer in writers.values():
+                writer.abort()
+            raise
+        for writer in writers.values():
+            writer.close()
+        with self.connection:
+            self.connection.execute("DELETE FROM marker WHERE cog IN (%s)" % ','.join('?' * len(markers)), list(markers))
+            self.connection.executemany("INSERT OR REPLACE INTO marker VALUES (?, ?, ?, ?)", rows)
+        self.fasta_indexes = {}
+        return sorted(missing)
+
+    def sequence(self, gi, cog = None):
+        """
+        return the protein sequence of a GI, read from its COG file
+        """
+        if cog is None:
+            row = self.connection.execute("SELECT cog FROM marker WHERE gi = ?", (str(gi),)).fetchone()
+            if row is None:
+                return None
+            cog = row[0]
+        if cog not in self.fasta_indexes:
+            self.fasta_indexes[cog] = read_index(self.filename(cog))
+        return read_region(self.filename(cog), str(gi), self.fasta_indexes[cog])
+
+    def by_organism(self, organism):
+        """
+        return the (COG, GI, accession) of the markers of an organism
+        """
+        return self.connection.execute(
+            "SELECT cog, gi, accession FROM marker WHERE organism = ? ORDER BY cog", (organism,)).fetchall()
+
+    def organisms(self, cogs = None):
+        """
+        return the organisms having a marker in every COG of cogs (all COGs if None)
+        """
+        if cogs is None:
+            cogs = [row[0] for row in self.connection.execute("SELECT DISTINCT cog FROM marker")]
+        return [row[0] for row in self.connection.execute(
+            "SELECT organism FROM marker WHERE cog IN (%s) GROUP BY organism "
+            "HAVING count(DISTINCT cog) = ?" % ','.join('?' * len(cogs)), list(cogs) + [len(cogs)])]
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cog", action = "append", help = "COG family to retrieve, may be repeated (default all)")
+    parser.add_argument("--workers", type = int, default = 4, help = "concurrent downloads")
+    parser.add_argument("--batch-size", type = int, default = BATCH_SIZE, help = "GIs per request")
+    parser.add_argument("--api-key", help = "NCBI API key, raises the rate limit to 10 requests/s")
+    args = parser.parse_args()
+    if args.api_key:
+        entrez.set_api_key(args.api_key)
+    markers = load_markers()
+    if args.cog:
+        markers = {cog: markers[cog] for cog in args.cog}
+    print(str(len(markers)) + " COG families, " + str(len(marker_cogs(markers))) + " distinct GIs")
+    store = MarkerStore()
+    missing = store.build(markers, args.workers, args.batch_size)
+    store.close()
+    if len(missing) != 0:
+        print(str(len(missing)) + " GIs not retrieved")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
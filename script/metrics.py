@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+time spent in each stage of a fetch run, per accession and per run
+
+    network_wait     waiting for the E-utilities to answer a request
+    download         receiving and splitting the records of an answer
+    xml_parse        reading a record back from the cache and parsing it
+    location_decode  parsing the feature locations
+    extraction       cutting and reverse complementing the regions
+    file_write       writing the FASTA files
+
+The times are summed over threads, downloads running concurrently can
+add up to more than the elapsed time of the run.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+
+STAGES = ["network_wait", "download", "xml_parse", "location_decode", "extraction", "file_write"]
+# stages grouped by the resource they wait for
+BOUNDS = {"network": ["network_wait", "download"], "parsing": ["xml_parse", "location_decode", "extraction"], "disk": ["file_write"]}
+
+METRICS_PATH = "../metrics/"
+
+class Metrics:
+    """
+    seconds and calls of every stage, counters such as bytes_received,
+    for the whole run and for each accession
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.calls = dict.fromkeys(STAGES, 0)
+        self.counters = {}
+        # accession -> {stage or counter: value}
+        self.accessions = {}
+
+    def add_time(self, stage, seconds, accession = None, calls = 1):
+        with self.lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            self.calls[stage] = self.calls.get(stage, 0) + calls
+            if accession is not None:
+                entry = self.accessions.setdefault(accession, {})
+                entry[stage] = entry.get(stage, 0.0) + seconds
+
+    def count(self, name, value = 1, accession = None):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            if accession is not None:
+                entry = self.accessions.setdefault(accession, {})
+                entry[name] = entry.get(name, 0) + value
+
+    def label(self, accession, **labels):
+        """
+        attach labels such as the organism name to an accession
+        """
+        with self.lock:
+            self.accessions.setdefault(accession, {}).update(labels)
+
+    @contextlib.contextmanager
+    def timer(self, stage, accession = None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start, accession)
+
+    def summary(self):
+        """
+        return the run totals as a dict
+        """
+        with self.lock:
+            return {"elapsed": time.time() - self.start, "seconds": dict(self.seconds), "calls": dict(self.calls),
+                    "counters": dict(self.counters), "nb_accessions": len(self.accessions)}
+
+    def bound(self):
+        """
+        return the resource the run spent most of its time on
+        """
+        seconds = self.summary()["seconds"]
+        return max(BOUNDS, key = lambda bound: sum(seconds[stage] for stage in BOUNDS[bound]))
+
+    def write_jsonl(self, filename):
+        """
+        append one line per accession and one line for the run
+        """
+        with self.lock:
+            accessions = {accession: dict(entry) for (accession, entry) in self.accessions.items()}
+        with open(filename, 'a') as f:
+            for (accession, entry) in accessions.items():
+                entry.update({"type": "accession", "accession": accession})
+                f.write(json.dumps(entry) + "\n")
+            run = self.summary()
+            run.update({"type": "run", "start": self.start, "bound": self.bound()})
+            f.write(json.dumps(run) + "\n")
+
+    def prometheus(self):
+        """
+        return the metrics in the Prometheus text format
+        """
+        summary = self.summary()
+        with self.lock:
+            accessions = {accession: dict(entry) for (accession, entry) in self.accessions.items()}
+        lines = ["# HELP bioinfo_stage_seconds_total Seconds spent in each stage of the run.",
+                 "# TYPE bioinfo_stage_seconds_total counter"]
+        lines += ['bioinfo_stage_seconds_total{stage="%s"} %f' % (stage, seconds) for (stage, seconds) in summary["seconds"].items()]
+        lines += ["# HELP bioinfo_stage_calls_total Number of times each stage ran.",
+                  "# TYPE bioinfo_stage_calls_total counter"]
+        lines += ['bioinfo_stage_calls_total{stage="%s"} %d' % (stage, calls) for (stage, calls) in summary["calls"].items()]
+        for (name, value) in sorted(summary["counters"].items()):
+            lines += ["# TYPE bioinfo_%s_total counter" % name, "bioinfo_%s_total %d" % (name, value)]
+        lines += ["# HELP bioinfo_accession_stage_seconds Seconds spent in each stage for an accession.",
+                  "# TYPE bioinfo_accession_stage_seconds gauge"]
+        for (accession, entry) in sorted(accessions.items()):
+            for stage in STAGES:
+                if stage in entry:
+                    lines.append('bioinfo_accession_stage_seconds{accession="%s",stage="%s"} %f' % (accession, stage, entry[stage]))
+        return "\n".join(lines) + "\n"
+
+    def write(self, prefix):
+        """
+        write <prefix>.jsonl and <prefix>.prom
+        """
+        if os.path.dirname(prefix) and not os.path.exists(os.path.dirname(prefix)):
+            os.makedirs(os.path.dirname(prefix))
+        self.write_jsonl(prefix + ".jsonl")
+        with open(prefix + ".prom", 'w') as f:
+            f.write(self.prometheus())
+
+    def report(self):
+        """
+        return a few lines summing up the run for a log
+        """
+        summary = self.summary()
+        total = sum(summary["seconds"].values()) or 1.0
+        lines = [str(summary["nb_accessions"]) + " accessions, %.1f MB received in %.1f s"
+                 % (summary["counters"].get("bytes_received", 0) / 1e6, summary["elapsed"])]
+        for stage in STAGES:
+            lines.append("  %-16s %8.2f s %5.1f %%" % (stage, summary["seconds"][stage], summary["seconds"][stage] / total * 100))
+        lines.append("Bound by " + self.bound())
+        return lines
+
+# metrics of the current run, replaced by start_run
+recorder = Metrics()
+
+def start_run():
+    """
+    start recording a new run
+    return its Metrics
+    """
+    global recorder
+    recorder = Metrics()
+    return recorder
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+local stand-in for the NCBI E-utilities (epost, efetch, esummary) serving
+synthetic GBSeq nucleotide and protein records, used to measure the download
+layer without network access
+
+    python3 mock_entrez.py --port 8000
+    python3 mock_entrez.py --throughput 200 --workers 4
+"""
+import argparse
+import http.server
+import json
+import random
+import tempfile
+import threading
+import time
+import urllib.parse
+
+FEATURE_KEYS = ["CDS", "tRNA", "rRNA", "ncRNA", "intron", "mobile_element"]
+UPDATE_DATE = "2020/01/01"
+
+def synthetic_record(accession, length = 5000, nb_features = 20, version = 1):
+    """
+    return the GBSeq XML of a reproducible synthetic record, each version has its own content
+    """
+    generator = random.Random(accession if version == 1 else accession + "." + str(version))
+    sequence = ''.join(generator.choice('acgt') for i in range(length))
+    features = ['<GBFeature><GBFeature_key>source</GBFeature_key>'
+                '<GBFeature_location>1..%d</GBFeature_location></GBFeature>' % length]
+    for i in range(nb_features):
+        start = generator.randint(1, length - 200)
+        end = start + generator.randint(20, 199)
+        location = "%d..%d" % (start, end)
+        if generator.random() < 0.5:
+            location = "complement(" + location + ")"
+        features.append('<GBFeature><GBFeature_key>%s</GBFeature_key><GBFeature_location>%s</GBFeature_location></GBFeature>'
+                        % (generator.choice(FEATURE_KEYS), location))
+    return ('<GBSeq><GBSeq_locus>%s</GBSeq_locus><GBSeq_length>%d</GBSeq_length>'
+            '<GBSeq_primary-accession>%s</GBSeq_primary-accession>'
+            '<GBSeq_accession-version>%s.%d</GBSeq_accession-version>'
+            '<GBSeq_feature-table>%s</GBSeq_feature-table>'
+            '<GBSeq_sequence>%s</GBSeq_sequence></GBSeq>'
+            % (accession, length, accession, accession, version, ''.join(features), sequence))
+
+def synthetic_protein(gi, length = 150):
+    """
+    return the GBSeq XML of a reproducible synthetic protein record
+    """
+    generator = random.Random(gi)
+    sequence = ''.join(generator.choice('acdefghiklmnpqrstvwy') for i in range(length))
+    return ('<GBSeq><GBSeq_primary-accession>WP_%s</GBSeq_primary-accession>'
+            '<GBSeq_accession-version>WP_%s.1</GBSeq_accession-version>'
+            '<GBSeq_other-seqids><GBSeqid>ref|WP_%s.1|</GBSeqid><GBSeqid>gi|%s</GBSeqid></GBSeq_other-seqids>'
+            '<GBSeq_organism>Organism %d</GBSeq_organism>'
+            '<GBSeq_sequence>%s</GBSeq_sequence></GBSeq>'
+            % (gi, gi, gi, gi, generator.randint(1, 50), sequence))
+
+class MockEntrez(http.server.ThreadingHTTPServer):
+    """
+    threaded HTTP server answering epost.fcgi, efetch.fcgi and esummary.fcgi.
+    latency is added to every answer and error_rate of the requests fail
+    with a 503. Records are at version 1 updated on UPDATE_DATE, set
+    versions[accession] and update_dates[accession] to publish a new one
+    """
+    daemon_threads = True
+
+    def __init__(self, port = 0, latency = 0.0, error_rate = 0.0, length = 5000, nb_features = 20):
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.length = length
+        self.nb_features = nb_features
+        self.posted = {}
+        self.versions = {}
+        self.update_dates = {}
+        self.nb_requests = 0
+        # number of requests per E-utility
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    def summary(self, id):
+        """
+        return the esummary version 2.0 document of an accession
+        """
+        accession = id.split('.')[0]
+        return {"uid": accession, "caption": accession,
+                "accessionversion": accession + "." + str(self.versions.get(accession, 1)),
+                "updatedate": self.update_dates.get(accession, UPDATE_DATE)}
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d/" % self.server_port
+
+    def start(self):
+        threading.Thread(target = self.serve_forever, daemon = True).start()
+        return self
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _answer(self, code, body, content_type = 'text/xml'):
+        body = body.encode()
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        params = urllib.parse.parse_qs(self.rfile.read(length).decode())
+        cgi = self.path.rsplit('/', 1)[-1]
+        with server.lock:
+            server.nb_requests += 1
+            server.requests[cgi] = server.requests.get(cgi, 0) + 1
+        time.sleep(server.latency)
+        if random.random() < server.error_rate:
+            self._answer(503, "<ERROR>Service unavailable</ERROR>")
+            return
+        if cgi == "epost.fcgi":
+            with server.lock:
+                query_key = str(len(server.posted) + 1)
+                server.posted[query_key] = params["id"][0].split(',')
+            self._answer(200, "<ePostResult><QueryKey>%s</QueryKey><WebEnv>MOCK</WebEnv></ePostResult>" % query_key)
+        elif cgi == "efetch.fcgi":
+            if "query_key" in params:
+                ids = server.posted.get(params["query_key"][0], [])
+            else:
+                ids = params["id"][0].split(',')
+            if params.get("db") == ["protein"]:
+                records = ''.join(synthetic_protein(id) for id in ids)
+            else:
+                # an accession without version is served at its current version
+                records = ''.join(synthetic_record(id.split('.')[0], server.length, server.nb_features,
+                                                   int(id.split('.')[1]) if '.' in id else server.versions.get(id, 1))
+                                  for id in ids)
+            self._answer(200, "<GBSet>" + records + "</GBSet>")
+        elif cgi == "esummary.fcgi":
+            summaries = [server.summary(id) for id in params["id"][0].split(',')]
+            result = {"uids": [summary["uid"] for summary in summaries]}
+            result.update((summary["uid"], summary) for summary in summaries)
+            self._answer(200, json.dumps({"header": {"type": "esummary", "version": "0.3"}, "result": result}), 'application/json')
+        else:
+            self._answer(404, "<ERROR>Unknown E-utility " + cgi + "</ERROR>")
+
+def measure_throughput(nb_accessions, workers, rate, latency, error_rate, batch_size):
+    """
+    download nb_accessions synthetic records through the scheduler
+    return (seconds, number of requests)
+    """
+    import entrez
+    from cache import RecordCache
+    from scheduler import Scheduler
+
+    server = MockEntrez(latency = latency, error_rate = error_rate).start()
+    entrez.eutils_url = server.url
+    entrez.batch_size = batch_size
+    entrez.rate_limiter.rate = entrez.rate_limiter.capacity = rate
+    scheduler = Scheduler(workers = workers, backoff = 0.1)
+    ids = ["NC_%06d" % i for i in range(nb_accessions)]
+    with tempfile.TemporaryDirectory() as root:
+        cache = RecordCache(root)
+        def download(batch):
+            return entrez.download_records(batch, cache = cache)
+        batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+        jobs = ((batch, download, (batch,), batch[0]) for batch in batches)
+        start = time.perf_counter()
+        for (tag, result, error) in scheduler.map(jobs):
+            if error is not None:
+                print(tag + " failed : " + str(error))
+        elapsed = time.perf_counter() - start
+        cache.close()
+    server.shutdown()
+    return elapsed, server.nb_requests
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type = int, default = 8000)
+    parser.add_argument("--latency", type = float, default = 0.05, help = "seconds added to every answer")
+    parser.add_argument("--error-rate", type = float, default = 0.0, help = "fraction of requests answered with a 503")
+    parser.add_argument("--throughput", type = int, metavar = "N", help = "download N accessions and report the throughput")
+    parser.add_argument("--workers", type = int, default = 4)
+    parser.add_argument("--rate", type = float, default = 10, help = "requests per second allowed by the token bucket")
+    parser.add_argument("--batch-size", type = int, default = 1)
+    args = parser.parse_args()
+    if args.throughput:
+        (elapsed, nb_requests) = measure_throughput(args.throughput, args.workers, args.rate, args.latency, args.error_rate, args.batch_size)
+        print("%d accessions, %d requests in %.2f s : %.1f accessions/s" % (args.throughput, nb_requests, elapsed, args.throughput / elapsed))
+        return
+    server = MockEntrez(args.port, args.latency, args.error_rate)
+    print("Mock E-utilities listening on " + server.url)
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
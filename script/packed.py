@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+2-bit packed nucleotide container for extracted regions
+
+    python3 packed.py pack Escherichia_coli_CDS.fasta     writes Escherichia_coli_CDS.pack
+    python3 packed.py export Escherichia_coli_CDS.pack    writes Escherichia_coli_CDS.fasta
+
+A .pack file holds a header, the packed regions and an index at the end:
+
+    header   magic, version, number of regions, offset of the index
+    region   4 bases per byte (A=0 C=1 G=2 T=3, first base in the high bits),
+             then the runs of non-ACGT codes (start, length and code arrays)
+             and the runs of lowercase bases (start and length arrays)
+    index    per region: name, description, length, offset and run counts
+
+Regions are read through a memory map, any region or part of a region is
+decoded without touching the others.
+"""
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+
+from fasta import FastaWriter
+
+MAGIC = b"BGPK"
+VERSION = 1
+_HEADER = struct.Struct("<4sIIQ")
+# name length, description length, length, data offset, exception runs, lowercase runs
+_ENTRY = struct.Struct("<HHQQII")
+
+_CODES = np.zeros(256, dtype = np.uint8)
+_VALID = np.zeros(256, dtype = bool)
+for (code, base) in enumerate(b"ACGT"):
+    _CODES[base] = _CODES[base + 32] = code
+    _VALID[base] = _VALID[base + 32] = True
+# the 4 bases of every packed byte
+_UNPACK = np.frombuffer(b"ACGT", dtype = np.uint8)[
+    np.array([[(byte >> shift) & 3 for shift in (6, 4, 2, 0)] for byte in range(256)], dtype = np.uint8)]
+
+def _runs(mask):
+    """
+    return (starts, lengths) of the runs of True in mask
+    """
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    return starts, np.flatnonzero(edges == -1) - starts
+
+_TRANSLATE = bytes(_CODES)
+_NO_RUNS = np.zeros(0, dtype = np.int64)
+
+def _pack_codes(codes):
+    padded = np.zeros(-(-len(codes) // 4) * 4, dtype = np.uint8)
+    padded[:len(codes)] = np.frombuffer(codes, dtype = np.uint8)
+    padded = padded.reshape(-1, 4)
+    return ((padded[:, 0] << 6) | (padded[:, 1] << 4) | (padded[:, 2] << 2) | padded[:, 3]).tobytes()
+
+def pack(sequence):
+    """
+    return (packed bytes, exception starts, lengths and codes, lowercase starts and lengths)
+    of sequence (bytes)
+    """
+    codes = sequence.translate(_TRANSLATE)
+    # most regions are plain ACGT in a single case
+    if len(sequence.translate(None, b"ACGTacgt")) == 0 and (sequence.isupper() or sequence.islower()):
+        lower = np.array([0, len(sequence)]) if sequence.islower() else _NO_RUNS
+        return _pack_codes(codes), _NO_RUNS, _NO_RUNS, _NO_RUNS.astype(np.uint8), lower[:1], lower[1:]
+    bases = np.frombuffer(sequence, dtype = np.uint8)
+    lower = (bases >= 97) & (bases <= 122)
+    upper = np.where(lower, bases - 32, bases).astype(np.uint8)
+    # runs of the same non-ACGT code, a run of N is a single exception
+    other = ~_VALID[bases]
+    continues = np.zeros(len(bases), dtype = bool)
+    continues[1:] = other[:-1] & other[1:] & (upper[1:] == upper[:-1])
+    starts = np.flatnonzero(other & ~continues)
+    # a run ends at the next base that does not continue it
+    breaks = np.append(np.flatnonzero(~continues), len(bases))
+    ends = breaks[np.searchsorted(breaks, starts, side = "right")]
+    (lower_starts, lower_lengths) = _runs(lower)
+    return _pack_codes(codes), starts, ends - starts, upper[starts], lower_starts, lower_lengths
+
+class PackedWriter:
+    """
+    writer of .pack files with the interface of FastaWriter, the file is
+    written to a temporary file renamed over filename by close()
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.tmp = filename + ".tmp"
+        self.out = open(self.tmp, 'wb')
+        self.out.write(_HEADER.pack(MAGIC, VERSION, 0, 0))
+        self.index = []
+        self.nb_records = 0
+
+    def write(self, name, sequence, description = ''):
+        """
+        append a region, name must be unique
+        """
+        (packed, starts, lengths, codes, lower_starts, lower_lengths) = pack(sequence)
+        offset = self.out.tell()
+        self.out.write(packed)
+        for array in (starts.astype("<u4"), lengths.astype("<u4"), codes, lower_starts.astype("<u4"), lower_lengths.astype("<u4")):
+            self.out.write(array.tobytes())
+        self.index.append((name.encode(), description.encode(), len(sequence), offset, len(starts), len(lower_starts)))
+        self.nb_records += 1
+
+    def close(self):
+        """
+        write the index and publish the file
+        """
+        index_offset = self.out.tell()
+        for (name, description, length, offset, nb_exceptions, nb_lower) in self.index:
+            self.out.write(_ENTRY.pack(len(name), len(description), length, offset, nb_exceptions, nb_lower))
+            self.out.write(name + description)
+        self.out.seek(0)
+        self.out.write(_HEADER.pack(MAGIC, VERSION, len(self.index), index_offset))
+        self.out.close()
+        os.replace(self.tmp, self.filename)
+
+    def abort(self):
+        """
+        drop the file being written
+        """
+        self.out.close()
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+class PackedReader:
+    """
+    memory-mapped reader of a .pack file
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        (magic, version, nb_regions, index_offset) = _HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(filename + " is not a packed region file")
+        # name -> (description, length, offset, exceptions, lowercase runs)
+        self.index = {}
+        self.names = []
+        position = index_offset
+        for i in range(nb_regions):
+            (name_length, description_length, length, offset, nb_exceptions, nb_lower) = _ENTRY.unpack_from(self.map, position)
+            position += _ENTRY.size
+            name = self.map[position:position + name_length].decode()
+            description = self.map[position + name_length:position + name_length + description_length].decode()
+            position += name_length + description_length
+            self.index[name] = (description, length, offset, nb_exceptions, nb_lower)
+            self.names.append(name)
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.names)
+
+    def description(self, name):
+        return self.index[name][0]
+
+    def length(self, name):
+        return self.index[name][1]
+
+    def _runs(self, name):
+        (description, length, offset, nb_exceptions, nb_lower) = self.index[name]
+        position = offset + -(-length // 4)
+        arrays = []
+        for (count, dtype) in ((nb_exceptions, "<u4"), (nb_exceptions, "<u4"), (nb_exceptions, np.uint8), (nb_lower, "<u4"), (nb_lower, "<u4")):
+            array = np.frombuffer(self.map, dtype = dtype, count = count, offset = position)
+            position += array.nbytes
+            arrays.append(array)
+        return arrays
+
+    def region(self, name, start = 0, end = None):
+        """
+        return the bases start to end (0-based, end excluded) of a region,
+        only the bytes holding them are read
+        """
+        (description, length, offset, nb_exceptions, nb_lower) = self.index[name]
+        end = length if end is None else min(end, length)
+        if start >= end:
+            return b''
+        first = start // 4
+        packed = np.frombuffer(self.map, dtype = np.uint8, count = -(-end // 4) - first, offset = offset + first)
+        bases = _UNPACK[packed].ravel()[start - first * 4:end - first * 4].copy()
+        if nb_exceptions or nb_lower:
+            (starts, lengths, codes, lower_starts, lower_lengths) = self._runs(name)
+            for (run_start, run_length, code) in zip(starts, lengths, codes):
+                if run_start < end and run_start + run_length > start:
+                    bases[max(run_start, start) - start:min(run_start + run_length, end) - start] = code
+            for (run_start, run_length) in zip(lower_starts, lower_lengths):
+                if run_start < end and run_start + run_length > start:
+                    bases[max(run_start, start) - start:min(run_start + run_length, end) - start] += 32
+        return bases.tobytes()
+
+    def __iter__(self):
+        """
+        yield (name, description, sequence) in file order
+        """
+        for name in self.names:
+            yield name, self.index[name][0], self.region(name)
+
+    def export_fasta(self, filename):
+        """
+        write the regions to an indexed FASTA file, one region at a time
+        """
+        with FastaWriter(filename) as writer:
+            for (name, description, sequence) in self:
+                writer.write(name, sequence, description)
+
+def iter_fasta(filename):
+    """
+    yield (name, description, sequence) of the records of a FASTA file
+    """
+    name = description = None
+    lines = []
+    with open(filename, 'rb') as f:
+        for line in f:
+            line = line.rstrip(b'\r\n')
+            if line.startswith(b'>'):
+                if name is not None:
+                    yield name, description, b''.join(lines)
+                (name, space, description) = line[1:].decode().partition(' ')
+                lines = []
+            elif name is not None:
+                lines.append(line)
+    if name is not None:
+        yield name, description, b''.join(lines)
+
+def pack_fasta(filename, packed_filename):
+    """
+    convert a FASTA file to a .pack file
+    """
+    with PackedWriter(packed_filename) as writer:
+        for (name, description, sequence) in iter_fasta(filename):
+            writer.write(name, sequence, description)
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ("pack", "export"):
+        print(__doc__)
+        return 1
+    for filename in sys.argv[2:]:
+        (root, extension) = os.path.splitext(filename)
+        if sys.argv[1] == "pack":
+            pack_fasta(filename, root + ".pack")
+            print(filename + " : %d -> %d bytes" % (os.path.getsize(filename), os.path.getsize(root + ".pack")))
+        else:
+            with PackedReader(filename) as reader:
+                reader.export_fasta(root + ".fasta")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+parse and extract cached records on a pool of processes
+
+The download threads of the Scheduler feed the pool, at most max_pending
+records are parsed at a time: downloads are only pulled when the pool has
+room, so memory stays bounded however large the clade. Regions come back
+to the calling thread, the only one writing files.
+"""
+import concurrent.futures
+import gzip
+import multiprocessing
+import time
+
+import entrez
+from location import extract_regions
+
+def extract_cached(filename, NC, keys):
+    """
+    parse the cached record of NC and extract its regions, runs in a worker process
+    return (accession, [(key, location, region)], timings), accession None if the record cannot be read
+    """
+    start = time.perf_counter()
+    timings = {"xml_parse": 0.0, "location_decode": 0.0, "extraction": 0.0}
+    with gzip.open(filename, 'rb') as source:
+        for record in entrez.iter_records(source, keys):
+            timings["xml_parse"] = time.perf_counter() - start
+            return record.version or NC, list(extract_regions(record.sequence.encode(), record.features, keys, timings)), timings
+    return None, [], timings
+
+def _context():
+    # download threads are running when the pool starts, fork them safely
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        # workers are forked from a server that already imported this module
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context("spawn")
+
+def extract_in_pool(downloads, keys, cache, write, processes, cancel = None, on_downloaded = None, max_pending = None):
+    """
+    extract the organisms of downloads, the (organism, result, error) yielded by
+    Scheduler.map with organism an (index, name, path, NC_list), on processes
+    worker processes. write(name, path, NC_list, records) writes the regions
+    of an organism from its (accession, regions, timings) in NC order and
+    returns None if a record is missing
+    yield (name, nb_region_found) as organisms complete, None if the download or extraction failed
+    """
+    if max_pending is None:
+        max_pending = 2 * processes
+    with concurrent.futures.ProcessPoolExecutor(processes, mp_context = _context()) as pool:
+        # name -> (path, NC_list, futures of its NC), in download order
+        organisms = {}
+        pending = set()
+        downloads_left = True
+        while downloads_left or organisms:
+            # bounded queue: the next download is only taken when the pool has room
+            while downloads_left and len(pending) < max_pending:
+                item = next(downloads, None)
+                if item is None:
+                    downloads_left = False
+                    break
+                ((index, name, path, NC_list), nb_downloaded, error) = item
+                if cancel is not None and cancel.is_set():
+                    continue
+                if error is not None:
+                    print("Download failed for organism [" + name + "] : " + str(error))
+                    yield name, None
+                    continue
+                if on_downloaded is not None:
+                    on_downloaded(name, NC_list)
+                futures = []
+                for NC in NC_list:
+                    filename = cache.path(NC)
+                    if filename is None:
+                        print("Not in record cache : " + NC)
+                        continue
+                    futures.append(pool.submit(extract_cached, filename, NC, keys))
+                organisms[name] = (path, NC_list, futures)
+                pending.update(futures)
+            if cancel is not None and cancel.is_set():
+                for future in pending:
+                    future.cancel()
+                return
+            if pending:
+                (done, not_done) = concurrent.futures.wait(pending, return_when = concurrent.futures.FIRST_COMPLETED)
+                pending = not_done
+            # single writer: organisms are written once all their records are extracted
+            for name in [name for (name, (path, NC_list, futures)) in organisms.items() if all(future.done() for future in futures)]:
+                (path, NC_list, futures) = organisms.pop(name)
+                try:
+                    nb_region_found = write(name, path, NC_list, (future.result() for future in futures))
+                except Exception as error:
+                    print("Extraction failed for organism [" + name + "] : " + str(error))
+                    yield name, None
+                    continue
+                yield name, nb_region_found
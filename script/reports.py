@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+typed loading of the genome report tables of GENOME_REPORTS
+
+Each table is read in one vectorized pass with explicit dtypes, the
+repeated text columns (kingdom, group, subgroup, assembly level) are
+categorical so they cost one small integer per row.
+"""
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+
+REPORTS_PATH = "../GENOME_REPORTS/"
+
+_READ_OPTIONS = {"sep": '\t', "quoting": csv.QUOTE_NONE, "keep_default_na": False}
+
+OVERVIEW_COLUMNS = ["#Organism/Name", "Kingdom", "Group", "SubGroup"]
+
+EUKARYOTES_DTYPES = {
+    "#Organism/Name": "string",
+    "TaxID": "int64",
+    "BioProject Accession": "string",
+    "BioProject ID": "int64",
+    "Group": "category",
+    "SubGroup": "category",
+    "Size (Mb)": "float64",
+    "GC%": "float64",
+    "Assembly Accession": "string",
+    "Replicons": "string",
+    "WGS": "string",
+    "Scaffolds": "Int64",
+    "Genes": "Int64",
+    "Proteins": "Int64",
+    "Status": "category",
+    "Center": "string",
+    "BioSample Accession": "string",
+}
+
+def _path_part(column):
+    # the categories are cleaned once instead of every row
+    return column.astype("category").cat.rename_categories(
+        lambda value: value.replace(' ', '_').replace('/', '_'))
+
+def load_overview(filename = None):
+    """
+    return the organisms of overview.txt, the first row of each name only,
+    with categorical Kingdom, Group and SubGroup
+    """
+    if filename is None:
+        filename = REPORTS_PATH + "overview.txt"
+    overview = pd.read_csv(filename, usecols = OVERVIEW_COLUMNS, dtype = object, **_READ_OPTIONS)
+    overview = overview.drop_duplicates("#Organism/Name", keep = "first")
+    for column in OVERVIEW_COLUMNS[1:]:
+        overview[column] = overview[column].astype("category")
+    return overview
+
+def load_ids(path = None):
+    """
+    return the NC accessions of the IDS files as a (taxid, NC, name)
+    dataframe, in the order of the files
+    """
+    if path is None:
+        path = REPORTS_PATH + "IDS/"
+    frames = []
+    for ids in os.listdir(path):
+        # the description column is optional, the columns are named once read
+        frame = pd.read_csv(path + ids, header = None, usecols = [0, 1, 5],
+                            dtype = {0: "int64", 1: object, 5: object}, **_READ_OPTIONS)
+        frame.columns = ["taxid", "NC", "name"]
+        frames.append(frame[frame["NC"].str.startswith("NC")])
+    return pd.concat(frames, ignore_index = True)
+
+def organism_index(overview, ids):
+    """
+    join overview.txt and the IDS files
+    return (names, paths, NC lists) of the organisms having NC accessions,
+    in the order they first appear in the IDS files
+    """
+    # one path string per (kingdom, group, subgroup), shared by its organisms
+    paths = ("../Results/" + _path_part(overview["Kingdom"]).astype(str) + '/'
+             + _path_part(overview["Group"]).astype(str) + '/'
+             + _path_part(overview["SubGroup"]).astype(str) + '/').astype("category")
+    rows = pd.Index(overview["#Organism/Name"]).get_indexer(ids["name"])
+    known = rows >= 0
+    if not known.any():
+        return [], [], []
+    # codes number the names in order of first appearance, a stable sort
+    # keeps the NC accessions of each organism in file order
+    (codes, names) = pd.factorize(ids["name"].to_numpy(object)[known])
+    order = np.argsort(codes, kind = "stable")
+    boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+    NC_lists = [NC_list.tolist() for NC_list in np.split(ids["NC"].to_numpy(object)[known][order], boundaries)]
+    first_rows = rows[known][order][np.concatenate(([0], boundaries))]
+    return names.tolist(), paths.take(first_rows).tolist(), NC_lists
+
+def load_eukaryotes(filename = None):
+    """
+    return eukaryotes.txt with typed columns, '-' as missing values, and
+    the number of chromosomes of each assembly counted from Replicons
+    """
+    if filename is None:
+        filename = REPORTS_PATH + "eukaryotes.txt"
+    eukaryotes = pd.read_csv(filename, dtype = EUKARYOTES_DTYPES, na_values = {column: ['-', ''] for column in EUKARYOTES_DTYPES},
+                             usecols = lambda column: column in EUKARYOTES_DTYPES or column.endswith("Date"), **_READ_OPTIONS)
+    for column in ("Release Date", "Modify Date"):
+        eukaryotes[column] = pd.to_datetime(eukaryotes[column], format = "%Y/%m/%d", errors = "coerce")
+    eukaryotes["Chromosomes"] = eukaryotes["Replicons"].str.count(r"(?:^|; )chromosome ").fillna(0).astype("int32")
+    return eukaryotes
+
+def select_assemblies(eukaryotes, min_size = None, max_size = None, min_gc = None, max_gc = None,
+                      levels = None, min_chromosomes = None, max_chromosomes = None):
+    """
+    filter the assemblies of load_eukaryotes on their size in Mb, GC%,
+    assembly level (Chromosome, Complete Genome, Scaffold, Contig) and
+    number of chromosomes, None leaves a criterion out
+    """
+    mask = pd.Series(True, index = eukaryotes.index)
+    for (column, low, high) in (("Size (Mb)", min_size, max_size), ("GC%", min_gc, max_gc),
+                                ("Chromosomes", min_chromosomes, max_chromosomes)):
+        if low is not None:
+            mask &= eukaryotes[column] >= low
+        if high is not None:
+            mask &= eukaryotes[column] <= high
+    if levels is not None:
+        mask &= eukaryotes["Status"].isin(levels)
+    return eukaryotes[mask]
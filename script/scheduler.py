@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+import collections
+import concurrent.futures
+import random
+import socket
+import threading
+import time
+from urllib.error import HTTPError, URLError
+
+class TokenBucket:
+    """
+    thread-safe token bucket: at most rate acquisitions per second,
+    bursts of up to capacity. The default capacity of 1 spaces acquisitions
+    by 1 / rate, so no second ever holds more than rate of them
+    """
+    def __init__(self, rate, capacity = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        block until a token is available and take it
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def is_transient(error):
+    """
+    return True if a failed request is worth retrying: network errors,
+    server errors and 429 Too Many Requests. Errors returned by the
+    E-utilities and local file errors would happen again
+    """
+    if isinstance(error, HTTPError):
+        return error.code // 100 == 5 or error.code == 429
+    return isinstance(error, (URLError, socket.timeout, ConnectionError))
+
+class Scheduler:
+    """
+    run download jobs on a thread pool, retrying transient errors with
+    exponential backoff and jitter. Each job is tagged with the accessions it
+    covers, attempts and last error are accounted per accession.
+    """
+    def __init__(self, workers = 4, max_tries = 5, backoff = 1.0, max_backoff = 60.0):
+        self.workers = workers
+        self.max_tries = max_tries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.attempts = collections.Counter()
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def _run(self, keys, func, args):
+        for attempt in range(self.max_tries):
+            with self.lock:
+                for key in keys:
+                    self.attempts[key] += 1
+            try:
+                result = func(*args)
+            except Exception as error:
+                with self.lock:
+                    for key in keys:
+                        self.errors[key] = error
+                if attempt == self.max_tries - 1 or not is_transient(error):
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.5))
+            else:
+                with self.lock:
+                    for key in keys:
+                        self.errors.pop(key, None)
+                return result
+
+    def map(self, jobs):
+        """
+        run jobs, an iterable of (keys, func, args, tag), at most workers at
+        a time. yield (tag, result, error) as they complete, error is None on
+        success
+        """
+        jobs = iter(jobs)
+        with concurrent.futures.ThreadPoolExecutor(max_workers = self.workers) as executor:
+            running = {}
+            while True:
+                # keep a bounded number of jobs in flight
+                for (keys, func, args, tag) in jobs:
+                    running[executor.submit(self._run, keys, func, args)] = tag
+                    if len(running) >= 2 * self.workers:
+                        break
+                if len(running) == 0:
+                    return
+                (done, not_done) = concurrent.futures.wait(running, return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    tag = running.pop(future)
+                    error = future.exception()
+                    yield tag, (future.result() if error is None else None), error
+
+    def failed(self):
+        """
+        return {accession: last error} for the accessions whose last attempt failed
+        """
+        with self.lock:
+            return dict(self.errors)
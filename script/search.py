@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+type-ahead search over the organism names and NC accessions
+
+    python3 search.py "escherichia col"
+    python3 search.py NC_000913
+
+Matches are ranked: exact name or accession, then prefixes of the name,
+of one of its words or of an accession (with or without its NC_ prefix),
+then names sharing most of the trigrams of the query, which tolerates
+typos and infixes.
+"""
+import bisect
+import re
+import sys
+import time
+
+import numpy as np
+
+from store import organism_dir
+
+# score of the prefix matches, above any trigram match (at most 2)
+_EXACT = 6
+_NAME_PREFIX = 5
+_ACCESSION_PREFIX = 4
+_WORD_PREFIX = 3
+# share of the trigrams of the query a name must have
+MIN_SIMILARITY = 0.5
+# prefix keys looked at for a very short query, names ranked on their trigrams
+MAX_PREFIX_KEYS = 2000
+MAX_TRIGRAM_CANDIDATES = 2000
+# versioned accession, the index holds them without version
+_VERSIONED = re.compile(r"[a-z]{1,2}_?[0-9]+\.[0-9]+")
+
+def _trigrams(text):
+    text = " " + text + " "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class SearchIndex:
+    """
+    in-memory prefix and trigram index of the organisms of an OrganismStore.
+    Matches are identified by the organism directory, the iid of its tree node
+    """
+    def __init__(self, store):
+        self.names = []
+        self.directories = []
+        # lowercase name of every organism
+        self.documents = []
+        keys = []
+        postings = {}
+        for (index, name, path, NC_list) in store.organisms():
+            id = len(self.names)
+            self.names.append(name)
+            self.directories.append(organism_dir(name, path))
+            lower = name.lower()
+            accessions = [NC.lower() for NC in NC_list]
+            self.documents.append(lower)
+            keys.append((lower, id, _NAME_PREFIX))
+            words = lower.split(' ')
+            for i in range(1, len(words)):
+                keys.append((' '.join(words[i:]), id, _WORD_PREFIX))
+            for accession in set(accessions):
+                keys.append((accession, id, _ACCESSION_PREFIX))
+                keys.append((accession.partition('_')[2], id, _ACCESSION_PREFIX))
+            # accessions are only looked up by prefix
+            for trigram in _trigrams(lower):
+                postings.setdefault(trigram, []).append(id)
+        keys.sort()
+        self.keys = [key for (key, id, weight) in keys]
+        self.key_ids = [id for (key, id, weight) in keys]
+        self.key_weights = [weight for (key, id, weight) in keys]
+        self.postings = {trigram: np.array(ids, dtype = np.int32) for (trigram, ids) in postings.items()}
+
+    def __len__(self):
+        return len(self.names)
+
+    def search(self, query, limit = 20):
+        """
+        return up to limit (name, directory, score) matching query, best first
+        """
+        query = ' '.join(query.lower().split())
+        if query == '':
+            return []
+        if _VERSIONED.fullmatch(query):
+            query = query.rsplit('.', 1)[0]
+        scores = {}
+        start = bisect.bisect_left(self.keys, query)
+        end = min(bisect.bisect_left(self.keys, query + '\U0010ffff'), start + MAX_PREFIX_KEYS)
+        for i in range(start, end):
+            score = self.key_weights[i]
+            if self.keys[i] == query and score != _WORD_PREFIX:
+                score = _EXACT
+            id = self.key_ids[i]
+            if score > scores.get(id, 0):
+                scores[id] = score
+        trigrams = [trigram for trigram in _trigrams(query) if trigram.strip()]
+        if len(query) >= 3 and len(trigrams) != 0:
+            lists = [self.postings[trigram] for trigram in trigrams if trigram in self.postings]
+            if len(lists) != 0:
+                counts = np.bincount(np.concatenate(lists), minlength = len(self.names))
+                candidates = np.flatnonzero(counts >= MIN_SIMILARITY * len(trigrams))
+                if len(candidates) > MAX_TRIGRAM_CANDIDATES:
+                    candidates = candidates[np.argpartition(-counts[candidates], MAX_TRIGRAM_CANDIDATES)[:MAX_TRIGRAM_CANDIDATES]]
+                for id in candidates.tolist():
+                    # substrings rank above names only sharing trigrams
+                    score = counts[id] / len(trigrams) + (1 if query in self.documents[id] else 0)
+                    if score > scores.get(id, 0):
+                        scores[id] = score
+        best = sorted(scores, key = lambda id: (-scores[id], len(self.names[id]), self.names[id]))[:limit]
+        return [(self.names[id], self.directories[id], float(scores[id])) for id in best]
+
+def main():
+    import fetch
+    store = fetch.load_store()
+    start = time.perf_counter()
+    index = SearchIndex(store)
+    print("%d organisms indexed in %.2f s" % (len(index), time.perf_counter() - start))
+    for query in sys.argv[1:]:
+        start = time.perf_counter()
+        matches = index.search(query)
+        print("%s : %d matches in %.1f ms" % (query, len(matches), (time.perf_counter() - start) * 1000))
+        for (name, directory, score) in matches:
+            print("  %.2f  %s  (%s)" % (score, name, directory))
+
+if __name__ == "__main__":
+    main()
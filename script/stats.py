@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+statistics of the extracted regions under the Results tree
+
+    python3 stats.py Bacteria/Proteobacteria             totals per region key
+    python3 stats.py Archaea --organisms --csv archaea.csv
+
+For every region file the number of regions, their length distribution,
+the base counts (GC%, GC and AT skews, N content) are computed with NumPy
+and cached in ../pickle/stats.db, keyed by the file mtime and size: only
+files written since the last scan are read again. Summaries are rolled up
+along the kingdom/group/subgroup directories.
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+
+import numpy as np
+
+import fetch
+from fasta import read_index
+from packed import PackedReader
+from store import organism_dir
+
+STATS_PATH = "../pickle/stats.db"
+# regions are counted in log2 length bins, which add up along the hierarchy
+NB_BINS = 32
+_PREFIX_END = '\U0010ffff'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_stats (
+    filename TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    key TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    summary TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS file_stats_dir ON file_stats(dir);
+"""
+
+_COUNTED = {base: i for (i, base) in enumerate("ACGTN")}
+# byte -> column of the base counts, lowercase counted with uppercase, 5 for other codes
+_BASE_COLUMN = np.full(256, 5, dtype = np.uint8)
+for (base, i) in _COUNTED.items():
+    _BASE_COLUMN[ord(base)] = _BASE_COLUMN[ord(base.lower())] = i
+_BASE_COLUMN[ord('\n')] = _BASE_COLUMN[ord('\r')] = 6
+
+def _summary(lengths, counts, gc_per_region):
+    """
+    return the summary of regions of lengths, counts the A C G T N other totals
+    """
+    lengths = np.asarray(lengths, dtype = np.int64)
+    bins = np.bincount(np.minimum(np.log2(np.maximum(lengths, 1)).astype(np.int64), NB_BINS - 1), minlength = NB_BINS)
+    return {"regions": int(len(lengths)), "bases": int(lengths.sum()),
+            "min_length": int(lengths.min()) if len(lengths) else 0, "max_length": int(lengths.max()) if len(lengths) else 0,
+            "length_bins": bins.tolist(), "counts": [int(count) for count in counts],
+            "gc_sum": float(gc_per_region.sum()), "gc_square_sum": float((gc_per_region ** 2).sum())}
+
+def summarize_fasta(filename):
+    """
+    count the bases of every region of an indexed FASTA file in one pass over its bytes
+    """
+    index = list(read_index(filename).values())
+    data = np.fromfile(filename, dtype = np.uint8)
+    lengths = np.array([entry[0] for entry in index], dtype = np.int64)
+    starts = np.array([entry[1] for entry in index], dtype = np.int64)
+    # a region spans its bases and the newlines wrapping them
+    ends = starts + lengths + np.array([(entry[0] - 1) // entry[2] if entry[0] else 0 for entry in index], dtype = np.int64)
+    inside = np.zeros(len(data) + 1, dtype = np.int8)
+    np.add.at(inside, starts, 1)
+    np.add.at(inside, ends, -1)
+    columns = _BASE_COLUMN[data]
+    counts = np.bincount(columns[np.cumsum(inside[:-1], dtype = np.int8) > 0], minlength = 7)[:6]
+    # GC count of each region, summed between its start and end
+    is_gc = ((columns == 1) | (columns == 2)).astype(np.uint8)
+    gc_per_region = np.zeros(len(index))
+    if len(index) != 0:
+        bounds = np.minimum(np.column_stack((starts, ends)).ravel(), len(data) - 1)
+        gc = np.add.reduceat(is_gc, bounds, dtype = np.int64)[::2]
+        gc_per_region = np.where(lengths > 0, gc, 0) / np.maximum(lengths, 1)
+    return _summary(lengths, counts, gc_per_region)
+
+def summarize_packed(filename):
+    """
+    count the bases of every region of a packed file
+    """
+    lengths = []
+    gc_per_region = []
+    counts = np.zeros(7, dtype = np.int64)
+    with PackedReader(filename) as reader:
+        for (name, description, sequence) in reader:
+            region_counts = np.bincount(_BASE_COLUMN[np.frombuffer(sequence, dtype = np.uint8)], minlength = 7)
+            counts += region_counts
+            lengths.append(len(sequence))
+            gc_per_region.append((region_counts[1] + region_counts[2]) / max(len(sequence), 1))
+    return _summary(lengths, counts[:6], np.array(gc_per_region))
+
+def empty_summary():
+    return _summary([], [0] * 6, np.zeros(0))
+
+def merge(total, summary):
+    """
+    add summary to total in place
+    """
+    if summary["regions"] == 0:
+        return total
+    if total["regions"] == 0:
+        total["min_length"] = summary["min_length"]
+    else:
+        total["min_length"] = min(total["min_length"], summary["min_length"])
+    total["max_length"] = max(total["max_length"], summary["max_length"])
+    for field in ("regions", "bases", "gc_sum", "gc_square_sum"):
+        total[field] += summary[field]
+    for field in ("length_bins", "counts"):
+        total[field] = [a + b for (a, b) in zip(total[field], summary[field])]
+    return total
+
+def derived(summary):
+    """
+    return the figures shown for a summary: mean length, median length bin,
+    GC%, GC and AT skews, N content and the spread of the GC% of regions
+    """
+    (a, c, g, t, n, other) = summary["counts"]
+    regions = max(summary["regions"], 1)
+    cumulated = np.cumsum(summary["length_bins"])
+    median_bin = int(np.searchsorted(cumulated, summary["regions"] / 2)) if summary["regions"] else 0
+    gc_mean = summary["gc_sum"] / regions
+    return {"regions": summary["regions"], "bases": summary["bases"],
+            "mean_length": summary["bases"] / regions, "min_length": summary["min_length"], "max_length": summary["max_length"],
+            "median_length_range": (2 ** median_bin, 2 ** (median_bin + 1)),
+            "gc": (g + c) / max(a + c + g + t, 1) * 100, "gc_skew": (g - c) / max(g + c, 1), "at_skew": (a - t) / max(a + t, 1),
+            "n_content": n / max(summary["bases"], 1) * 100, "other": other,
+            "gc_region_std": float(np.sqrt(max(summary["gc_square_sum"] / regions - gc_mean ** 2, 0))) * 100}
+
+def region_files(directory):
+    """
+    yield (key, filename) of the region files of an organism directory
+    """
+    name = os.path.basename(directory.rstrip('/'))
+    try:
+        entries = os.listdir(directory)
+    except OSError:
+        return
+    extensions = {extension: format for (format, (extension, side_files, writer)) in fetch.OUTPUT_FORMATS.items()}
+    for entry in sorted(entries):
+        (root, extension) = os.path.splitext(entry)
+        if extension in extensions and root.startswith(name + "_"):
+            yield root[len(name) + 1:], directory + entry
+
+class StatsCache:
+    """
+    summaries of the region files, rescanned when their mtime or size change
+    """
+    def __init__(self, filename = STATS_PATH):
+        if os.path.dirname(filename) and not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        self.connection = sqlite3.connect(filename, check_same_thread = False)
+        self.connection.executescript(_SCHEMA)
+        self.nb_scanned = 0
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, directory):
+        """
+        rescan the region files of an organism directory that changed, and
+        forget the files that are gone
+        """
+        cached = {row[0]: (row[1], row[2]) for row in self.connection.execute(
+            "SELECT filename, mtime_ns, size FROM file_stats WHERE dir = ?", (directory,))}
+        rows = []
+        for (key, filename) in region_files(directory):
+            stat = os.stat(filename)
+            if cached.pop(filename, None) == (stat.st_mtime_ns, stat.st_size):
+                continue
+            summary = summarize_packed(filename) if filename.endswith(fetch.OUTPUT_FORMATS["packed"][0]) else summarize_fasta(filename)
+            rows.append((filename, directory, key, stat.st_mtime_ns, stat.st_size, json.dumps(summary)))
+            self.nb_scanned += 1
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO file_stats VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.connection.executemany("DELETE FROM file_stats WHERE filename = ?", [(filename,) for filename in cached])
+
+    def organism(self, directory):
+        """
+        return {key: summary} of an organism directory, up to date
+        """
+        self.update(directory)
+        return {key: json.loads(summary) for (key, summary) in self.connection.execute(
+            "SELECT key, summary FROM file_stats WHERE dir = ? ORDER BY key", (directory,))}
+
+    def rollup(self, store, prefix):
+        """
+        return ({key: summary}, number of organisms with regions) under the
+        directory prefix, e.g. '../Results/Bacteria/', up to date
+        """
+        for (index, name, path, NC_list) in store.organisms_under(prefix):
+            self.update(organism_dir(name, path))
+        totals = {}
+        directories = set()
+        for (directory, key, summary) in self.connection.execute(
+                "SELECT dir, key, summary FROM file_stats WHERE dir >= ? AND dir < ?", (prefix, prefix + _PREFIX_END)):
+            merge(totals.setdefault(key, empty_summary()), json.loads(summary))
+            directories.add(directory)
+        return totals, len(directories)
+
+def format_rollup(totals, nb_organisms):
+    """
+    return the lines describing a rollup, one per region key
+    """
+    if len(totals) == 0:
+        return ["Aucune région extraite"]
+    lines = [str(nb_organisms) + " organismes avec des régions extraites"]
+    for (key, summary) in sorted(totals.items()):
+        figures = derived(summary)
+        lines.append("%s : %d régions, longueur moyenne %.0f (%d-%d), GC %.1f %% (± %.1f), skew GC %+.3f AT %+.3f, N %.2f %%"
+                     % (key, figures["regions"], figures["mean_length"], figures["min_length"], figures["max_length"],
+                        figures["gc"], figures["gc_region_std"], figures["gc_skew"], figures["at_skew"], figures["n_content"]))
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("prefix", nargs = "*", default = [""], help = "clade path under Results, e.g. Bacteria/Proteobacteria")
+    parser.add_argument("--organisms", action = "store_true", help = "one row per organism and region key")
+    parser.add_argument("--csv", metavar = "FILE", help = "write the rows to a CSV file")
+    args = parser.parse_args()
+    store = fetch.load_store()
+    cache = StatsCache()
+    rows = []
+    for prefix in args.prefix:
+        prefix = '../Results/' + (prefix.strip('/') + '/' if prefix.strip('/') else '')
+        if args.organisms:
+            for (index, name, path, NC_list) in store.organisms_under(prefix):
+                for (key, summary) in cache.organism(organism_dir(name, path)).items():
+                    rows.append(dict(organism = name, path = path, key = key, **derived(summary)))
+        else:
+            (totals, nb_organisms) = cache.rollup(store, prefix)
+            print(prefix)
+            for line in format_rollup(totals, nb_organisms):
+                print("  " + line)
+            rows += [dict(prefix = prefix, key = key, **derived(summary)) for (key, summary) in sorted(totals.items())]
+    print(str(cache.nb_scanned) + " files scanned", file = sys.stderr)
+    if args.csv and rows:
+        with open(args.csv, 'w', newline = '') as f:
+            writer = csv.DictWriter(f, fieldnames = list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    elif args.organisms:
+        for row in rows:
+            print("%s\t%s\t%d\t%.0f\t%.1f" % (row["organism"], row["key"], row["regions"], row["mean_length"], row["gc"]))
+    cache.close()
+    store.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
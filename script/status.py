@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+import os
+import time
+
+from store import VERSIONS_SUFFIX, organism_dir
+
+ROOT = "../Results/"
+
+class StatusTree:
+    """
+    number of organisms and of downloaded organisms under every directory
+    of the Results tree, keyed by directory path ('../Results/Archaea/').
+    Marking an organism only updates its own directory and its ancestors.
+    """
+    def __init__(self, root = ROOT):
+        self.root = root
+        self.total = {}
+        self.downloaded = {}
+        self.organisms = {}
+
+    def prefixes(self, organism_dir):
+        """
+        return the directories from the root down to organism_dir
+        """
+        parts = organism_dir[len(self.root):].strip('/').split('/')
+        prefixes = [self.root]
+        for part in parts:
+            prefixes.append(prefixes[-1] + part + '/')
+        return prefixes
+
+    def add(self, organism_dir, downloaded = False):
+        """
+        register an organism directory
+        """
+        if organism_dir in self.organisms:
+            return
+        self.organisms[organism_dir] = downloaded
+        for prefix in self.prefixes(organism_dir):
+            self.total[prefix] = self.total.get(prefix, 0) + 1
+            self.downloaded[prefix] = self.downloaded.get(prefix, 0) + (1 if downloaded else 0)
+
+    def set_downloaded(self, organism_dir, downloaded = True):
+        """
+        change the status of an organism
+        return the directories whose counts changed
+        """
+        if self.organisms.get(organism_dir, downloaded) == downloaded:
+            return []
+        self.organisms[organism_dir] = downloaded
+        prefixes = self.prefixes(organism_dir)
+        for prefix in prefixes:
+            self.downloaded[prefix] += 1 if downloaded else -1
+        return prefixes
+
+    def is_downloaded(self, directory):
+        """
+        True if every organism under directory is downloaded
+        """
+        return self.downloaded.get(directory, 0) == self.total.get(directory, 0)
+
+    def counts(self, directory):
+        """
+        return (downloaded, total) under directory
+        """
+        return self.downloaded.get(directory, 0), self.total.get(directory, 0)
+
+def has_downloads(organism_dir):
+    """
+    True if regions were extracted in organism_dir
+    """
+    try:
+        with os.scandir(organism_dir) as entries:
+            # the versions file alone is left by an extraction that found nothing
+            return any(not entry.name.endswith(VERSIONS_SUFFIX) for entry in entries)
+    except OSError:
+        return False
+
+def build_status(store):
+    """
+    build the StatusTree of every organism of the store, looking once at each directory
+    """
+    status = StatusTree()
+    for (index, name, path, NC_list) in store.organisms():
+        directory = organism_dir(name, path)
+        status.add(directory, has_downloads(directory))
+    return status
+
+def benchmark():
+    """
+    time the status update of one organism for growing catalogues
+    """
+    for nb_organisms in (1000, 10000, 100000):
+        status = StatusTree()
+        dirs = [ROOT + "K%d/G%d/S%d/organism_%d/" % (i % 5, i % 50, i % 500, i) for i in range(nb_organisms)]
+        for directory in dirs:
+            status.add(directory)
+        start = time.perf_counter()
+        for directory in dirs[:1000]:
+            status.set_downloaded(directory)
+        elapsed = (time.perf_counter() - start) / 1000
+        print("%6d organisms : %.2f us per update" % (nb_organisms, elapsed * 1e6))
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+import itertools
+import os
+import sqlite3
+
+import pandas as pd
+
+STORE_PATH = "../pickle/organism.db"
+SCHEMA_VERSION = 1
+
+# upper bound used to turn a path prefix into an indexed range query
+_PREFIX_END = '\U0010ffff'
+# versions of the records the regions of an organism were extracted from, next to its region files
+VERSIONS_SUFFIX = "_versions.json"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS organism (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    dir TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS accession (
+    organism_id INTEGER NOT NULL REFERENCES organism(id),
+    position INTEGER NOT NULL,
+    nc TEXT NOT NULL,
+    PRIMARY KEY (organism_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS organism_dir ON organism(dir);
+CREATE INDEX IF NOT EXISTS organism_name ON organism(name);
+CREATE INDEX IF NOT EXISTS organism_path ON organism(path);
+CREATE INDEX IF NOT EXISTS accession_nc ON accession(nc);
+"""
+
+def sanitize_name(name):
+    """
+    return the directory name used for an organism
+    """
+    return name.replace(" ", "_").replace("[", "_").replace("]", "_").replace(":", "_")
+
+def organism_dir(name, path):
+    """
+    return the Results directory of an organism
+    """
+    return path + sanitize_name(name) + "/"
+
+class OrganismStore:
+    """
+    organism index stored in SQLite: one row per organism, the NC accessions
+    flattened in their own table. Pages are read on demand (memory-mapped),
+    nothing is loaded when the store is opened.
+    """
+    def __init__(self, filename = STORE_PATH):
+        self.filename = filename
+        directory = os.path.dirname(filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        # the GUI reads the store from its worker threads too
+        self.connection = sqlite3.connect(filename, check_same_thread = False)
+        self.connection.execute("PRAGMA mmap_size = 268435456")
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    @property
+    def version(self):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+        return int(row[0]) if row is not None else 0
+
+    def get_meta(self, key):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def set_meta(self, key, value):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def __len__(self):
+        return self.connection.execute("SELECT count(*) FROM organism").fetchone()[0]
+
+    def write(self, names, paths, NC_lists):
+        """
+        replace the content of the store
+        """
+        with self.connection:
+            self.connection.execute("DELETE FROM accession")
+            self.connection.execute("DELETE FROM organism")
+            self.connection.executemany(
+                "INSERT INTO organism (id, name, path, dir) VALUES (?, ?, ?, ?)",
+                ((i, name, path, organism_dir(name, path)) for i, (name, path) in enumerate(zip(names, paths))))
+            self.connection.executemany(
+                "INSERT INTO accession (organism_id, position, nc) VALUES (?, ?, ?)",
+                ((i, position, NC) for i, NC_list in enumerate(NC_lists) for position, NC in enumerate(NC_list)))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+
+    def _grouped(self, cursor):
+        for (index, name, path), rows in itertools.groupby(cursor, key = lambda row: row[:3]):
+            yield index, name, path, [row[3] for row in rows]
+
+    def organisms(self):
+        """
+        iterate over (index, name, path, NC_list) of every organism
+        """
+        cursor = self.connection.execute(
+            "SELECT o.id, o.name, o.path, a.nc FROM organism o "
+            "JOIN accession a ON a.organism_id = o.id ORDER BY o.id, a.position")
+        return self._grouped(cursor)
+
+    def organisms_under(self, prefix):
+        """
+        iterate over (index, name, path, NC_list) of the organisms whose
+        directory starts with prefix, e.g. '../Results/Archaea/'
+        """
+        cursor = self.connection.execute(
+            "SELECT o.id, o.name, o.path, a.nc FROM organism o "
+            "JOIN accession a ON a.organism_id = o.id "
+            "WHERE o.dir >= ? AND o.dir < ? ORDER BY o.id, a.position",
+            (prefix, prefix + _PREFIX_END))
+        return self._grouped(cursor)
+
+    def children(self, prefix):
+        """
+        return the sub-directories of prefix and the (name, directory) of
+        the organisms directly under it, without reading the organisms of
+        deeper levels
+        """
+        subdirs = set()
+        for (path,) in self.connection.execute(
+                "SELECT DISTINCT path FROM organism WHERE path > ? AND path < ?", (prefix, prefix + _PREFIX_END)):
+            subdirs.add(prefix + path[len(prefix):].split('/')[0] + '/')
+        organisms = {}
+        for (name, dir) in self.connection.execute(
+                "SELECT name, dir FROM organism WHERE path = ? ORDER BY name", (prefix,)):
+            organisms.setdefault(dir, name)
+        return sorted(subdirs), [(name, dir) for (dir, name) in organisms.items()]
+
+    def organism(self, name):
+        """
+        return (index, name, path, NC_list) of an organism, None if unknown
+        """
+        cursor = self.connection.execute(
+            "SELECT o.id, o.name, o.path, a.nc FROM organism o "
+            "JOIN accession a ON a.organism_id = o.id "
+            "WHERE o.name = ? ORDER BY o.id, a.position", (name,))
+        return next(self._grouped(cursor), None)
+
+    def organisms_with(self, NC_list):
+        """
+        return the (index, name, path, NC_list) of the organisms having
+        one of the accessions of NC_list, looked up through the accession index
+        """
+        ids = set()
+        NC_list = list(NC_list)
+        # stay below the SQLite limit of bound parameters
+        for start in range(0, len(NC_list), 500):
+            chunk = NC_list[start:start + 500]
+            ids.update(row[0] for row in self.connection.execute(
+                "SELECT organism_id FROM accession WHERE nc IN (%s)" % ','.join('?' * len(chunk)), chunk))
+        organisms = []
+        for id in sorted(ids):
+            cursor = self.connection.execute(
+                "SELECT o.id, o.name, o.path, a.nc FROM organism o "
+                "JOIN accession a ON a.organism_id = o.id "
+                "WHERE o.id = ? ORDER BY a.position", (id,))
+            organisms.extend(self._grouped(cursor))
+        return organisms
+
+    def accessions_for(self, name):
+        """
+        return the NC accessions of an organism
+        """
+        cursor = self.connection.execute(
+            "SELECT a.nc FROM organism o JOIN accession a ON a.organism_id = o.id "
+            "WHERE o.name = ? ORDER BY a.position", (name,))
+        return [row[0] for row in cursor]
+
+    def to_dataframe(self):
+        """
+        load the whole store in the layout of the former pickled dataframe
+        """
+        names, paths, NC_lists = [], [], []
+        for (index, name, path, NC_list) in self.organisms():
+            names.append(name)
+            paths.append(path)
+            NC_lists.append(NC_list)
+        return pd.DataFrame({"name":names, "path":paths, "NC":NC_lists})
@@ -0,0 +1,50 @@
+"""
+the missing records of several organisms are downloaded in shared efetch
+requests, without posting the accessions to the history server first
+"""
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "script"))
+
+import entrez
+import fetch
+from cache import RecordCache
+from mock_entrez import MockEntrez
+
+def test_organisms_share_requests(tmp_path, monkeypatch):
+    server = MockEntrez(latency = 0).start()
+    monkeypatch.setattr(entrez, "eutils_url", server.url)
+    monkeypatch.setattr(entrez.rate_limiter, "rate", 1000)
+    cache = RecordCache(str(tmp_path / "cache"))
+    monkeypatch.setattr(fetch, "record_cache", cache)
+    monkeypatch.setattr(fetch, "offline", False)
+    monkeypatch.setattr(fetch, "check_versions", False)
+    path = str(tmp_path / "Results") + os.sep
+    organisms = []
+    for i in range(12):
+        NC_list = ["NC_%03d%03d" % (i, j) for j in range(1 + i % 4)]
+        organisms.append((i, "Organism %d" % i, path, NC_list))
+        os.makedirs(fetch.organism_dir("Organism %d" % i, path))
+    # an accession shared with the first organism is only downloaded once
+    organisms[5][3].append(organisms[0][3][0])
+    try:
+        results = dict(fetch.fetch_organisms(organisms, "CDS", fetch.Scheduler(backoff = 0.01), processes = 1))
+        assert sorted(results) == sorted(name for (index, name, path, NC_list) in organisms)
+        assert all(nb_region_found is not None for nb_region_found in results.values())
+        assert server.requests == {"efetch.fcgi": 1}
+        assert cache.stats()["stored"] == 30
+        # a smaller batch size splits the requests, not the organisms
+        monkeypatch.setattr(entrez, "batch_size", 7)
+        for (index, name, path, NC_list) in organisms:
+            for NC in NC_list:
+                cache.connection.execute("DELETE FROM record WHERE accession = ?", (NC,))
+        cache.connection.commit()
+        server.requests.clear()
+        results = dict(fetch.fetch_organisms(organisms, "CDS", fetch.Scheduler(backoff = 0.01), processes = 1))
+        assert all(nb_region_found is not None for nb_region_found in results.values())
+        assert server.requests == {"efetch.fcgi": 5}
+    finally:
+        server.shutdown()
+        cache.close()
@@ -0,0 +1,45 @@
+"""
+an accession listed several times in the NC list of an organism, as the
+IDS files of several groups do, must only be extracted once
+"""
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "script"))
+
+import fetch
+from cache import RecordCache
+from mock_entrez import synthetic_record
+
+NC_LIST = ["NC_000001", "NC_000002", "NC_000001", "NC_000001"]
+
+def headers(filename):
+    with open(filename) as f:
+        return [line[1:].split(' ')[0] for line in f if line.startswith('>')]
+
+def test_repeated_accession_written_once(tmp_path, monkeypatch):
+    cache = RecordCache(str(tmp_path / "cache"))
+    for NC in sorted(set(NC_LIST)):
+        cache.put(NC + ".1", NC, synthetic_record(NC, nb_features = 40).encode())
+    monkeypatch.setattr(fetch, "record_cache", cache)
+    monkeypatch.setattr(fetch, "offline", True)
+    monkeypatch.setattr(fetch, "output_format", "fasta")
+    path = str(tmp_path / "Results") + os.sep
+    # organism directories are made by reset_tree
+    for name in ("Organism once", "Organism repeated 1", "Organism repeated 2", "Organism written"):
+        os.makedirs(fetch.organism_dir(name, path))
+    once = fetch.load_data_from_NC(0, "Organism once", path, sorted(set(NC_LIST)), "CDS")
+    assert once > 0
+    for processes in (1, 2):
+        name = "Organism repeated %d" % processes
+        results = dict(fetch.fetch_organisms([(1, name, path, NC_LIST)], "CDS", processes = processes))
+        assert results == {name: once}
+        found = headers(fetch.region_filename(name, path, "CDS"))
+        assert len(found) == once
+        assert len(set(found)) == once
+        assert fetch.read_versions(name, path)["regions"]["CDS"][0] == once
+    # a record read twice by the caller is only written once
+    records = list(fetch._cached_regions(NC_LIST, {"CDS"}, download = False))
+    assert fetch.write_regions("Organism written", path, NC_LIST, {"CDS"}, records) == once
+    cache.close()
@@ -0,0 +1,67 @@
+"""
+the regions extracted by the location parser must match Biopython
+"""
+import os
+import random
+import sys
+
+import pytest
+from Bio.Seq import Seq
+from Bio.SeqFeature import Location
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "script"))
+
+from location import LocationError, extract, parse_location
+
+SEQUENCE = ''.join(random.Random(0).choice("ACGT") for i in range(300))
+
+LOCATIONS = [
+    "47",
+    "40..65",
+    "<45..100",
+    "<1..>88",
+    "1..300",
+    "complement(10..30)",
+    "complement(<1..>9)",
+    "join(10..20,30..40)",
+    "join(<10..20,30..>40)",
+    "complement(join(10..20,30..40))",
+    "join(complement(30..40),complement(10..20))",
+    "order(10..20,50..60)",
+    "order(complement(5..9),20..25)",
+]
+
+# locations nested deeper than Biopython parses, compared to the join of
+# the Biopython regions of their segments
+NESTED = [
+    ("join(1..5,complement(join(10..20,30..40)))", ["1..5", "complement(join(10..20,30..40))"]),
+    ("join(complement(order(1..3,5..8)),100..110)", ["complement(order(1..3,5..8))", "100..110"]),
+]
+
+def biopython(location):
+    return str(Location.fromstring(location).extract(Seq(SEQUENCE)))
+
+def region(location):
+    return extract(SEQUENCE.encode(), parse_location(location)).decode()
+
+@pytest.mark.parametrize("location", LOCATIONS)
+def test_same_region_as_biopython(location):
+    assert region(location) == biopython(location)
+
+@pytest.mark.parametrize("location, segments", NESTED)
+def test_nested_same_region_as_biopython(location, segments):
+    assert region(location) == ''.join(biopython(segment) for segment in segments)
+
+def test_partial():
+    assert parse_location("<1..>88").partial
+    assert not parse_location("complement(1..88)").partial
+
+@pytest.mark.parametrize("location", ["J00194.1:100..202", "join(1..4,J00194.1:100..202)", "102^103", "5.7", "bond(1,3)", "20..10"])
+def test_not_extractable(location):
+    with pytest.raises(LocationError):
+        parse_location(location)
+
+def test_beyond_sequence_end():
+    with pytest.raises(LocationError):
+        region("290..310")
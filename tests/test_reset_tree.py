@@ -0,0 +1,63 @@
+"""
+the organism index built from the genome reports must match the one of
+the original list.index implementation of reset_tree
+"""
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(ROOT, "script"))
+
+import fetch
+
+IDS_PATH = os.path.join(ROOT, "GENOME_REPORTS", "IDS") + os.sep
+OVERVIEW = os.path.join(HERE, "data", "overview.txt")
+
+def baseline_index(overview, ids_path):
+    # reset_tree before the index was vectorized, without creating directories
+    organism_names = []
+    organism_paths = []
+    with open(overview) as f:
+        first_row = True
+        for row in f:
+            if first_row:
+                first_row = False
+                continue
+            parsed_row = row.split('\t')
+            kingdom = parsed_row[1].replace(' ', '_').replace('/', '_')
+            group = parsed_row[2].replace(' ', '_').replace('/', '_')
+            subgroup = parsed_row[3].replace(' ', '_').replace('/', '_')
+            organism_names.append(parsed_row[0])
+            organism_paths.append('../Results/' + kingdom + '/' + group + '/' + subgroup + '/')
+    organism_names_ids = []
+    organism_paths_ids = []
+    organism_NC_ids = []
+    for ids in os.listdir(ids_path):
+        with open(ids_path + ids) as f:
+            for row in f:
+                parsed_row = row.replace('\n', '').split('\t')
+                if parsed_row[1][0:2] != 'NC':
+                    continue
+                try:
+                    index = organism_names.index(parsed_row[5])
+                except ValueError:
+                    continue
+                try:
+                    organism_NC_ids[organism_names_ids.index(organism_names[index])].append(parsed_row[1])
+                except ValueError:
+                    organism_names_ids.append(organism_names[index])
+                    organism_paths_ids.append(organism_paths[index])
+                    organism_NC_ids.append([parsed_row[1]])
+    return organism_names_ids, organism_paths_ids, organism_NC_ids
+
+def test_index_matches_baseline(tmp_path, monkeypatch):
+    (tmp_path / "overview.txt").write_bytes(open(OVERVIEW, 'rb').read())
+    os.symlink(IDS_PATH, str(tmp_path / "IDS"))
+    monkeypatch.setattr(fetch, "REPORTS_PATH", str(tmp_path) + os.sep)
+    (names, paths, NC_lists) = fetch.parse_reports()
+    (expected_names, expected_paths, expected_NC_lists) = baseline_index(OVERVIEW, IDS_PATH)
+    assert len(expected_names) > 40
+    assert names == expected_names
+    assert paths == expected_paths
+    assert NC_lists == expected_NC_lists